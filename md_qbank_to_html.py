@@ -4,11 +4,12 @@ Markdown题库转HTML插件
 支持自定义题库格式，生成离线可用的手机刷题HTML文件
 """
 
-import tkinter as tk
-from tkinter import filedialog, messagebox
 import re
+import itertools
+import sys
 import base64
 import mimetypes
+import os
 from pathlib import Path
 from urllib.parse import unquote  # 添加URL解码
 
@@ -20,97 +21,950 @@ class Plugin:
         self.tooltip = "将Markdown格式题库转换为离线HTML手机刷题文件"
 
     def execute_gui(self, root, status_text):
-        """GUI模式执行"""
-        # 选择输入的Markdown文件
-        md_file = filedialog.askopenfilename(
+        """GUI模式执行（转换在后台线程进行，界面不会卡住）"""
+        # Tk只在GUI模式下导入，命令行/无显示环境的服务器无需安装Tk
+        from tkinter import filedialog
+        
+        # 选择输入的Markdown文件（可多选，多个文件依次排队转换）
+        md_files = filedialog.askopenfilenames(
             title="选择Markdown题库文件",
             filetypes=[("Markdown文件", "*.md"), ("所有文件", "*.*")]
         )
-        if not md_file:
+        if not md_files:
             return
         
-        # 选择输出HTML文件路径
-        default_name = Path(md_file).stem + "_手机刷题神器.html"
-        html_file = filedialog.asksaveasfilename(
-            title="保存HTML文件",
-            defaultextension=".html",
-            initialfile=default_name,
-            filetypes=[("HTML文件", "*.html")]
-        )
-        if not html_file:
-            return
+        if len(md_files) == 1:
+            # 单个文件：选择输出HTML文件路径
+            md_file = md_files[0]
+            default_name = Path(md_file).stem + "_手机刷题神器.html"
+            html_file = filedialog.asksaveasfilename(
+                title="保存HTML文件",
+                defaultextension=".html",
+                initialfile=default_name,
+                filetypes=[("HTML文件", "*.html")]
+            )
+            if not html_file:
+                return
+            jobs = [(md_file, html_file)]
+        else:
+            # 多个文件：选择输出目录，文件名自动生成
+            out_dir = filedialog.askdirectory(title="选择HTML输出目录")
+            if not out_dir:
+                return
+            jobs = [(f, str(Path(out_dir) / (Path(f).stem + "_手机刷题神器.html")))
+                    for f in md_files]
+        
+        self._gui_enqueue(root, status_text, jobs)
+    
+    def _gui_enqueue(self, root, status_text, jobs):
+        """把转换任务加入后台队列，必要时新建一批任务（及其进度窗口）
+        
+        工作线程只有一个，常驻并阻塞等待任务。每批任务有自己的事件队列、取消标志和结果列表：
+        上一批还在进行时新任务并入该批；该批已取消或已结束时新建一批，互不干扰。
+        """
+        import queue
+        import threading
+        
+        if getattr(self, '_gui_lock', None) is None:
+            self._gui_lock = threading.Lock()
+            self._gui_jobs = queue.Queue()  # (md_file, html_file, 所属批次)
+            self._gui_batch = None          # 当前接收新任务的批次
+            threading.Thread(target=self._gui_work, daemon=True).start()
+        
+        with self._gui_lock:
+            batch = self._gui_batch
+            new_batch = batch is None or batch['cancel'].is_set()
+            if new_batch:
+                batch = self._gui_batch = {
+                    'events': queue.Queue(),        # 工作线程 -> Tk主线程的消息
+                    'cancel': threading.Event(),
+                    'results': [],
+                    'pending': 0,
+                }
+            batch['pending'] += len(jobs)
+            for md_file, html_file in jobs:
+                batch['events'].put(('log', f"加入队列：{Path(md_file).name}\n"))
+                self._gui_jobs.put((md_file, html_file, batch))
+        
+        if new_batch:
+            self._gui_show_progress(root, status_text, batch)
+    
+    def _gui_work(self):
+        """常驻工作线程：依次执行队列中的转换任务，只通过所属批次的事件队列与界面通信"""
+        import time
         
-        status_text.insert(tk.END, f"开始转换：{Path(md_file).name}\n")
-        status_text.see(tk.END)
-        root.update_idletasks()
+        last_report = [0.0]
         
-        try:
-            converter = MarkdownQBankConverter(md_file)
-            html_content = converter.convert()
+        while True:
+            md_file, html_file, batch = self._gui_jobs.get()
+            events = batch['events']
             
-            with open(html_file, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+            def progress(phase, done, total):
+                # 限制刷新频率，避免大题库时消息堆积
+                now = time.monotonic()
+                if done == total or now - last_report[0] >= 0.1:
+                    last_report[0] = now
+                    events.put(('progress', phase, done, total))
             
-            stats = converter.get_stats()
-            status_text.insert(tk.END, f"✓ 转换成功！\n")
-            status_text.insert(tk.END, f"  题库名称：{stats['title']}\n")
-            status_text.insert(tk.END, f"  题目总数：{stats['total']}\n")
-            for qtype, count in stats['by_type'].items():
-                status_text.insert(tk.END, f"  - {qtype}：{count}题\n")
-            status_text.insert(tk.END, f"  保存路径：{html_file}\n\n")
-            
-            messagebox.showinfo("成功", f"题库转换完成！\n共{stats['total']}道题\n可直接在手机浏览器中打开使用")
-        except Exception as e:
-            err_msg = f"转换失败：{str(e)}\n"
-            status_text.insert(tk.END, err_msg)
-            messagebox.showerror("错误", err_msg)
-        finally:
-            status_text.see(tk.END)
+            if batch['cancel'].is_set():
+                events.put(('log', f"已取消：{Path(md_file).name}\n"))
+            else:
+                events.put(('log', f"开始转换：{Path(md_file).name}\n"))
+                try:
+                    converter = MarkdownQBankConverter(md_file, progress=progress,
+                                                       cancel_event=batch['cancel'])
+                    converter.write(html_file)
+                    
+                    events.put(('done', converter.get_stats(), html_file))
+                except ConversionCancelled:
+                    events.put(('log', f"已取消：{Path(md_file).name}\n"))
+                except Exception as e:
+                    events.put(('error', f"转换失败：{str(e)}\n"))
+            
+            # 本批最后一个任务结束：通知进度窗口，之后加入的任务另起一批
+            with self._gui_lock:
+                batch['pending'] -= 1
+                if batch['pending'] == 0:
+                    events.put(('finished',))
+                    if self._gui_batch is batch:
+                        self._gui_batch = None
+    
+    def _gui_show_progress(self, root, status_text, batch):
+        """在Tk主线程中显示进度窗口并轮询工作线程的消息"""
+        import queue
+        import tkinter as tk
+        from tkinter import messagebox, ttk
+        
+        win = tk.Toplevel(root)
+        win.title("转换进度")
+        win.resizable(False, False)
+        phase_label = tk.Label(win, text="准备中...", width=40, anchor='w')
+        phase_label.pack(padx=12, pady=(12, 4))
+        bar = ttk.Progressbar(win, length=300, mode='determinate')
+        bar.pack(padx=12, pady=4)
+        
+        def cancel():
+            batch['cancel'].set()
+            phase_label.config(text="正在取消...")
+            cancel_btn.config(state=tk.DISABLED)
+        
+        cancel_btn = tk.Button(win, text="取消", command=cancel)
+        cancel_btn.pack(pady=(4, 12))
+        win.protocol("WM_DELETE_WINDOW", cancel)
+        
+        def poll():
+            try:
+                while True:
+                    event = batch['events'].get_nowait()
+                    kind = event[0]
+                    if kind == 'log':
+                        status_text.insert(tk.END, event[1])
+                    elif kind == 'progress':
+                        _, phase, done, total = event
+                        if total:
+                            bar.config(mode='determinate', maximum=total, value=done)
+                            phase_label.config(text=f"{phase}：{done}/{total}")
+                        else:
+                            bar.config(mode='indeterminate')
+                            bar.step()
+                            phase_label.config(text=f"{phase}：{done}")
+                    elif kind == 'done':
+                        _, stats, html_file = event
+                        batch['results'].append(stats)
+                        status_text.insert(tk.END, f"✓ 转换成功！\n")
+                        status_text.insert(tk.END, f"  题库名称：{stats['title']}\n")
+                        status_text.insert(tk.END, f"  题目总数：{stats['total']}\n")
+                        for qtype, count in stats['by_type'].items():
+                            status_text.insert(tk.END, f"  - {qtype}：{count}题\n")
+                        status_text.insert(tk.END, f"  保存路径：{html_file}\n\n")
+                    elif kind == 'error':
+                        status_text.insert(tk.END, event[1])
+                        messagebox.showerror("错误", event[1], parent=win)
+                    elif kind == 'finished':
+                        status_text.see(tk.END)
+                        win.destroy()
+                        self._gui_finish(batch['results'])
+                        return
+                    status_text.see(tk.END)
+            except queue.Empty:
+                pass
+            root.after(100, poll)
+        
+        poll()
+    
+    def _gui_finish(self, results):
+        """一批任务全部结束后的提示"""
+        from tkinter import messagebox
+        
+        if len(results) == 1:
+            messagebox.showinfo("成功", f"题库转换完成！\n共{results[0]['total']}道题\n可直接在手机浏览器中打开使用")
+        elif results:
+            total = sum(stats['total'] for stats in results)
+            messagebox.showinfo("成功", f"{len(results)}个题库转换完成！\n共{total}道题\n可直接在手机浏览器中打开使用")
 
     def execute_cli(self, args):
         """CLI模式执行"""
-        if len(args) < 1:
-            print("用法: md_qbank_to_html <markdown文件> [输出html文件]")
-            return
-        
-        md_file = args[0]
-        html_file = args[1] if len(args) > 1 else Path(md_file).stem + "_手机刷题神器.html"
-        
+        if args and args[0] == 'db':
+            return self._execute_db(args[1:])
+        if args and args[0] == 'exam':
+            return self._execute_exam(args[1:])
+        if args and args[0] == 'analyze':
+            return self._execute_analyze(args[1:])
+        if args and args[0] == 'index':
+            return self._execute_index(args[1:])
+        
+        parser = self._build_arg_parser()
         try:
-            converter = MarkdownQBankConverter(md_file)
-            html_content = converter.convert()
-            
-            with open(html_file, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+            opts = parser.parse_args(args)
+        except SystemExit as e:
+            # 参数错误时argparse会退出进程，作为插件运行时只返回状态码
+            return e.code
+        
+        # 兼容 md_file html_file 的写法：最后一个参数是.html时作为输出文件；
+        # 只有两个参数、第二个既不是.md也不是已存在的文件时（如 out、page.xhtml），也按旧写法处理并提示
+        inputs = opts.inputs
+        legacy = len(inputs) > 1 and Path(inputs[-1]).suffix.lower() in ('.html', '.htm')
+        if (not legacy and len(inputs) == 2 and not opts.output_dir
+                and Path(inputs[1]).suffix.lower() not in ('.md', '.markdown') and not Path(inputs[1]).exists()):
+            print(f"提示：{inputs[1]} 不是Markdown文件，按旧写法作为输出文件；"
+                  f"此写法将不再支持，请使用 .html 文件名或 -o 输出目录")
+            legacy = True
+        if legacy:
+            if len(inputs) > 2 or opts.output_dir:
+                print("指定输出文件时只能转换一个题库，批量转换请使用 -o 输出目录")
+                return 2
+            jobs = [(inputs[0], inputs[1])]
+        else:
+            out_dir = Path(opts.output_dir) if opts.output_dir else Path()
+            if not opts.dry_run:
+                out_dir.mkdir(parents=True, exist_ok=True)
+            jobs = [(md_file, str(out_dir / (Path(md_file).stem + "_手机刷题神器.html"))) for md_file in inputs]
+        
+        options = self._converter_options(opts)
+        failed = 0
+        for md_file, html_file in jobs:
+            manifest = BuildManifest(html_file)
+            reasons = ["--force"] if opts.force else manifest.check(md_file, options, update=not opts.dry_run)
+            if not reasons:
+                print(f"已是最新，跳过：{md_file}")
+                # 页面不必重建，但要求写出的源文件索引不存在或已过期时单独建立
+                index = QBankIndex(md_file)
+                if opts.index and not opts.dry_run and index.load() is None:
+                    try:
+                        index.build(opts.jobs)
+                        print(f"已建立索引：{index.path}")
+                    except Exception as e:
+                        print(f"建立索引失败：{e}")
+                        failed += 1
+            elif opts.dry_run:
+                print(f"需要重建：{md_file} -> {html_file}（{'；'.join(reasons)}）")
+            elif not self._convert_one(md_file, html_file, options, manifest, index=opts.index):
+                failed += 1
+        return 1 if failed else 0
+    
+    def _convert_one(self, md_file, html_file, options, manifest, index=False):
+        """转换一个题库并写出构建清单，返回是否成功"""
+        try:
+            source = BuildManifest.file_entry(md_file)
+            converter = MarkdownQBankConverter(md_file, index=index, **options)
+            converter.write(html_file)
+            manifest.record(converter, options, source)
             
             stats = converter.get_stats()
             print(f"转换成功！题库：{stats['title']}，共{stats['total']}题")
+            print(f"重复内容：{stats['dedup_ratio']:.1%}")
+            if stats['fragments']:
+                fragments = stats['fragments']
+                print(f"片段表：{fragments['table']}项，替换{fragments['references']}处引用")
+            if stats['remote_images']:
+                remote = stats['remote_images']
+                print(f"远程图片：下载{remote['downloaded']}，缓存有效{remote['revalidated']}，"
+                      f"离线使用缓存{remote['stale']}，失败{remote['failed']}")
             print(f"保存至：{html_file}")
         except Exception as e:
             print(f"转换失败：{e}")
+            return False
+        return True
+    
+    def _execute_db(self, args):
+        """题库数据库子命令：db ingest / db query"""
+        parser = self._build_db_arg_parser()
+        try:
+            opts = parser.parse_args(args)
+        except SystemExit as e:
+            return e.code
+        
+        try:
+            with QBankStore(opts.db) as store:
+                if opts.command == 'ingest':
+                    for md_file in opts.md_files:
+                        status = store.ingest(md_file, workers=opts.jobs)
+                        print(f"{QBankStore.STATUS_TEXT[status]}：{md_file}")
+                    return 0
+                
+                rows = store.search(opts.text, types=opts.type, bank=opts.bank, limit=opts.limit,
+                                    sample=opts.random, seed=opts.seed)
+                if not opts.output:
+                    for bank_title, q in rows:
+                        print(f"[{bank_title}] [{q.type}] {q.stem.splitlines()[0][:60]}")
+                    print(f"共{len(rows)}题")
+                    return 0
+                
+                title = opts.title or (f"检索：{opts.text}" if opts.text else "组卷练习")
+                converter = store.to_converter(rows, title, **self._converter_options(opts))
+                converter.write(opts.output)
+                print(f"生成成功！共{len(rows)}题，保存至：{opts.output}")
+        except Exception as e:
+            print(f"操作失败：{e}")
+            return 1
+        return 0
+    
+    def _execute_exam(self, args):
+        """exam 子命令：为每个学生生成随机试卷和答案"""
+        parser = self._build_exam_arg_parser()
+        try:
+            opts = parser.parse_args(args)
+        except SystemExit as e:
+            return e.code
+        
+        try:
+            if opts.students:
+                with open(opts.students, 'r', encoding='utf-8') as f:
+                    students = [line.strip() for line in f if line.strip()]
+            else:
+                width = len(str(opts.variants))
+                students = [str(i).zfill(width) for i in range(1, opts.variants + 1)]
+            
+            converter = MarkdownQBankConverter(opts.md_file, workers=opts.jobs)
+            generator = ExamGenerator(converter, opts.count, seed=opts.seed,
+                                      shuffle_options=not opts.no_shuffle_options,
+                                      workers=opts.jobs, title=opts.title)
+            out_dir = opts.output_dir or Path(opts.md_file).stem + "_试卷"
+            papers, key_file = generator.write(out_dir, students)
+            print(f"生成成功！{len(papers)}份试卷，每份{generator.count}题，保存至：{out_dir}")
+            print(f"答案：{key_file}")
+        except Exception as e:
+            print(f"生成失败：{e}")
+            return 1
+        return 0
+    
+    def _execute_analyze(self, args):
+        """analyze 子命令：汇总学生导出的答题记录，输出题目分析报告"""
+        parser = self._build_analyze_arg_parser()
+        try:
+            opts = parser.parse_args(args)
+        except SystemExit as e:
+            return e.code
+        
+        try:
+            paths = []
+            for result in opts.results:
+                result = Path(result)
+                paths.extend(sorted(result.glob('*.json')) if result.is_dir() else [result])
+            
+            converter = MarkdownQBankConverter(opts.md_file, workers=opts.jobs)
+            analysis = ItemAnalysis(converter, chunk_size=opts.chunk).run(paths)
+            report = opts.output or Path(opts.md_file).stem + "_题目分析.csv"
+            analysis.write_report(report)
+            
+            print(f"分析完成！{analysis.students}名学生，{len(converter.questions)}题")
+            if analysis.unknown:
+                print(f"忽略题库中已不存在的题目记录：{analysis.unknown}条")
+            for qtype, (done, right) in analysis.by_type().items():
+                rate = f"{right / done:.1%}" if done else "-"
+                print(f"  {qtype}：作答{done}次，正确率{rate}")
+            print(f"报告：{report}")
+            
+            if opts.html:
+                converter.badges = analysis.badges()
+                converter.write(opts.html)
+                print(f"带难度标注的题库：{opts.html}")
+        except Exception as e:
+            print(f"分析失败：{e}")
+            return 1
+        return 0
+    
+    def _execute_index(self, args):
+        """index 子命令：建立/刷新源文件索引，按序号或题号显示题目原文"""
+        parser = self._build_index_arg_parser()
+        try:
+            opts = parser.parse_args(args)
+        except SystemExit as e:
+            return e.code
+        
+        try:
+            index = QBankIndex(opts.md_file)
+            if opts.rebuild or index.load() is None:
+                index.build(opts.jobs)
+                print(f"已建立索引：{index.path}")
+            
+            ordinals = list(opts.ordinals)
+            for qid in opts.qid or ():
+                ordinals.extend(n + 1 for n in index.find(qid, opts.section))
+            if opts.section is not None and not opts.qid:
+                first, last = index.data['sections'][opts.section]['questions']
+                ordinals.extend(range(first + 1, last + 1))
+            
+            if not ordinals:
+                print(f"共{len(index)}题")
+                for k, (qtype, count) in enumerate(index.sections):
+                    lines = index.data['sections'][k]['lines']
+                    print(f"  [{k}] {qtype or '未分类'}：{count}题，第{lines[0]}-{lines[1]}行")
+                return 0
+            for n in ordinals:
+                if not 1 <= n <= len(index):
+                    print(f"没有第{n}题（共{len(index)}题）")
+                    return 1
+                first, last = index.location(n - 1)
+                q = index.question(n - 1)
+                print(f"第{n}题 [{q.type}] {opts.md_file}:{first}-{last}")
+                print(index.source(n - 1).rstrip())
+        except Exception as e:
+            print(f"操作失败：{e}")
+            return 1
+        return 0
+    
+    def _converter_options(self, opts):
+        """由命令行参数得到转换器的输出选项"""
+        return {
+            'workers': opts.jobs,
+            'minify': opts.minify,
+            'shard': opts.shard,
+            'shard_site': opts.site,
+            'dedup': opts.dedup,
+            'fetch_images': opts.fetch_images,
+            'image_cache': opts.image_cache,
+            'lazy_images': opts.lazy_images,
+            'pwa': opts.pwa,
+        }
+    
+    def _add_output_arguments(self, parser):
+        """转换和生成HTML共用的参数"""
+        import argparse
+        
+        def jobs(value):
+            n = int(value)
+            if n < 0:
+                raise argparse.ArgumentTypeError("并发数不能为负数")
+            return n or os.cpu_count() or 1
+        
+        def shard(value):
+            if value == 'section':
+                return value
+            n = int(value)
+            if n <= 0:
+                raise argparse.ArgumentTypeError("每块题数必须为正数")
+            return n
+        
+        parser.add_argument('-j', '--jobs', type=jobs, default=None, metavar='N',
+                            help="并发数，0表示CPU核数；大于1时对大文件启用多进程分块解析，并发预取图片")
+        parser.add_argument('--shard', type=shard, default=None, metavar='section|N',
+                            help="分块输出：按题型段落或每N题一块，页面按需展开，适合超大题库")
+        parser.add_argument('--site', action='store_true',
+                            help="配合--shard：分块写成同目录文件按需加载（需通过HTTP服务器访问）")
+        parser.add_argument('--minify', action='store_true',
+                            help="压缩输出：去掉模板和题目标记中的缩进、换行和注释")
+        parser.add_argument('--dedup', action='store_true',
+                            help="重复的选项和解析只保存一份，页面加载时展开，适合大量套话解析的题库")
+        parser.add_argument('--fetch-images', action='store_true',
+                            help="下载远程图片并嵌入页面（失败时保留原链接）")
+        parser.add_argument('--image-cache', default=None, metavar='DIR',
+                            help="远程图片的磁盘缓存目录（默认：~/.cache/md_qbank_to_html/images）")
+        parser.add_argument('--lazy-images', action='store_true',
+                            help="图片在题目显示时才解码，离开后释放，适合图片很多的题库（手机上更省内存）")
+        parser.add_argument('--pwa', action='store_true',
+                            help="写出Web应用清单和Service Worker：通过HTTP访问时可安装到桌面、离线使用，"
+                                 "更新时只下载变化的文件（配合--shard --site效果最好）")
+    
+    def _build_arg_parser(self):
+        """命令行参数"""
+        import argparse
+        
+        parser = argparse.ArgumentParser(
+            prog=self.name, description=self.tooltip,
+            epilog=f"题库数据库：{self.name} db {{ingest,query}} -h；批量生成试卷：{self.name} exam -h；"
+                   f"题目分析：{self.name} analyze -h；定位单题：{self.name} index -h")
+        parser.add_argument('inputs', nargs='+', metavar='md_file',
+                            help="Markdown题库文件（可多个）；只转换一个时可在最后给出输出HTML文件"
+                                 "（默认：<题库名>_手机刷题神器.html）")
+        parser.add_argument('-o', '--output-dir', help="批量转换的输出目录（默认：当前目录）")
+        parser.add_argument('--force', action='store_true',
+                            help="忽略构建清单，全部重新转换")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="只列出需要重新转换的题库及原因，不转换")
+        parser.add_argument('--index', action='store_true',
+                            help="同时在题库旁写出源文件索引（<题库文件>.qindex.json），供 index 子命令快速定位单题")
+        self._add_output_arguments(parser)
+        return parser
+    
+    def _build_db_arg_parser(self):
+        """db 子命令参数"""
+        import argparse
+        
+        parser = argparse.ArgumentParser(prog=f"{self.name} db",
+                                         description="题库数据库：导入多个题库，跨题库检索和组卷")
+        commands = parser.add_subparsers(dest='command', required=True)
+        
+        ingest = commands.add_parser('ingest', help="导入/增量更新题库（按文件哈希跳过未变化的题库）")
+        ingest.add_argument('db', help="SQLite数据库文件")
+        ingest.add_argument('md_files', nargs='+', help="Markdown题库文件")
+        ingest.add_argument('-j', '--jobs', type=int, default=None, metavar='N', help="解析并发数")
+        
+        query = commands.add_parser('query', help="全文检索题目，可直接生成HTML")
+        query.add_argument('db', help="SQLite数据库文件")
+        query.add_argument('text', nargs='?', help="检索关键词（匹配题干、选项和解析）")
+        query.add_argument('--type', action='append', help="题型（可重复），按包含匹配，如 多选")
+        query.add_argument('--bank', help="题库文件路径包含的文字")
+        query.add_argument('--limit', type=int, default=None, help="最多返回的题数")
+        query.add_argument('--random', action='store_true', help="随机抽取（配合--limit组卷）")
+        query.add_argument('--seed', type=int, default=None, help="随机种子")
+        query.add_argument('-o', '--output', help="输出HTML文件；省略时只列出结果")
+        query.add_argument('--title', help="生成页面的标题")
+        self._add_output_arguments(query)
+        return parser
+    
+    def _build_exam_arg_parser(self):
+        """exam 子命令参数"""
+        import argparse
+        
+        parser = argparse.ArgumentParser(prog=f"{self.name} exam",
+                                         description="从题库批量生成随机试卷：每人抽题、打乱选项，附答案")
+        parser.add_argument('md_file', help="Markdown题库文件")
+        parser.add_argument('-n', '--count', type=int, required=True, help="每份试卷的题数")
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--variants', type=int, default=1, metavar='N', help="试卷份数（学生编号为1..N）")
+        group.add_argument('--students', metavar='FILE', help="学生编号列表文件，每行一个")
+        parser.add_argument('--seed', default='0', help="试卷种子：同一种子和学生编号总是得到同一份试卷")
+        parser.add_argument('--title', help="试卷标题（默认：题库标题）")
+        parser.add_argument('--no-shuffle-options', action='store_true', help="不打乱选项顺序")
+        parser.add_argument('-o', '--output-dir', help="输出目录（默认：<题库名>_试卷）")
+        parser.add_argument('-j', '--jobs', type=int, default=None, metavar='N', help="并发数")
+        return parser
+    
+    def _build_analyze_arg_parser(self):
+        """analyze 子命令参数"""
+        import argparse
+        
+        parser = argparse.ArgumentParser(prog=f"{self.name} analyze",
+                                         description="汇总学生导出的答题记录：每题难度、区分度、选项分布和各题型正确率")
+        parser.add_argument('md_file', help="Markdown题库文件（与学生使用的页面为同一题库）")
+        parser.add_argument('results', nargs='+', help="答题记录JSON文件，或包含这些文件的目录")
+        parser.add_argument('-o', '--output', help="报告CSV文件（默认：<题库名>_题目分析.csv）")
+        parser.add_argument('--html', metavar='FILE', help="同时生成在题头标注难度和区分度的题库页面")
+        parser.add_argument('--chunk', type=int, default=256, metavar='N',
+                            help="每批读入的学生数（控制内存占用）")
+        parser.add_argument('-j', '--jobs', type=int, default=None, metavar='N', help="解析并发数")
+        return parser
+    
+    def _build_index_arg_parser(self):
+        """index 子命令参数"""
+        import argparse
+        
+        parser = argparse.ArgumentParser(prog=f"{self.name} index",
+                                         description="建立题库的源文件索引，不解析整个题库即可显示任一题的原文和行号")
+        parser.add_argument('md_file', help="Markdown题库文件")
+        parser.add_argument('ordinals', nargs='*', type=int, metavar='N',
+                            help="要显示的题目序号（按出现顺序从1开始）；省略时列出各题型段落")
+        parser.add_argument('--qid', action='append', metavar='题号', help="按Markdown中的题号查找（可重复）")
+        parser.add_argument('--section', type=int, default=None, metavar='K',
+                            help="题型段落序号（从0开始）：限定--qid的查找范围，单独使用时显示整个段落")
+        parser.add_argument('--rebuild', action='store_true', help="忽略已有索引，重新解析")
+        parser.add_argument('-j', '--jobs', type=int, default=None, metavar='N', help="解析并发数")
+        return parser
+
+
+class ConversionCancelled(Exception):
+    """转换被用户取消"""
+
+
+class Option:
+    """题目选项（__slots__，大题库下比dict节省内存）"""
+    __slots__ = ('num', 'text', 'is_correct', 'explanation')
+    
+    def __init__(self, num, text, is_correct=False, explanation=""):
+        self.num = sys.intern(num)
+        self.text = text
+        self.is_correct = is_correct
+        self.explanation = explanation
+    
+    def __reduce__(self):
+        # 跨进程传递时经由构造函数，保证字符串重新intern
+        return (Option, (self.num, self.text, self.is_correct, self.explanation))
+    
+    def __repr__(self):
+        return f"Option({self.num!r}, {self.text!r}, is_correct={self.is_correct!r})"
+
+
+class Question:
+    """题目：原始编号、题型（已intern）、题干、选项元组"""
+    __slots__ = ('id', 'type', 'stem', 'options')
+    
+    def __init__(self, id, type, stem, options=()):
+        self.id = sys.intern(id)
+        self.type = sys.intern(type)
+        self.stem = stem
+        self.options = tuple(options)
+    
+    def __reduce__(self):
+        return (Question, (self.id, self.type, self.stem, self.options))
+    
+    def __repr__(self):
+        return f"Question({self.id!r}, {self.type!r}, {self.stem[:20]!r}, {len(self.options)} options)"
+    
+    def __iter__(self):
+        return iter(self.options)
+    
+    def __len__(self):
+        return len(self.options)
+
+
+# 转换引擎各缓存的默认上限：Markdown渲染结果（按文本，条目数）、本地图片的data URI（总字节数）、预编译页面模板（条目数）
+MARKDOWN_CACHE_SIZE = 1 << 16
+IMAGE_CACHE_BYTES = 64 << 20
+TEMPLATE_CACHE_SIZE = 32
+
+# 片段表只收录渲染后不短于此长度的重复片段
+FRAGMENT_MIN_LENGTH = 24
+
+# 题目ID默认取内容哈希的前12位十六进制（48位）
+QUESTION_ID_LENGTH = 12
+
+
+def question_content_id(q, length=QUESTION_ID_LENGTH):
+    """由题型、题干、选项和正确答案计算题目ID（不含解析，修改解析不影响已保存的进度）"""
+    import hashlib
+    
+    h = hashlib.sha1()
+    h.update(q.type.encode('utf-8'))
+    h.update(b'\0')
+    h.update(q.stem.encode('utf-8'))
+    for opt in q.options:
+        h.update(b'\0')
+        h.update(opt.text.encode('utf-8'))
+        h.update(b'\1' if opt.is_correct else b'\2')
+    return h.hexdigest()[:length]
+
+
+class BoundedCache:
+    """线程安全的有界缓存，统计命中率
+    
+    policy 为 'lru'（命中时移到队尾）或 'fifo'（按加入顺序）；超过 max_entries 条，
+    或按 sizeof(值) 累计超过 max_bytes 时从队首淘汰。单个值超过 max_bytes 时不缓存。
+    写入和淘汰加锁；读取只用OrderedDict的单个原子操作，不加锁（每题要查十几次，锁的开销比查找本身还大），
+    因此命中统计在多线程下是近似值。
+    """
+    
+    POLICIES = ('lru', 'fifo')
+    
+    def __init__(self, max_entries=None, max_bytes=None, policy='lru', sizeof=len):
+        import threading
+        from collections import OrderedDict
+        
+        if policy not in self.POLICIES:
+            raise ValueError(f"不支持的淘汰策略：{policy}")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._lru = policy == 'lru'
+        self.sizeof = sizeof
+        self._data = OrderedDict()  # 键 -> (值, 大小)
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """取得缓存的值，不存在时返回None"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self._lru:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                # 刚被其他线程淘汰，仍返回已取得的值
+                pass
+        return entry[0]
+    
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._data[key] = (value, size)
+            self.size += size
+            while ((self.max_entries is not None and len(self._data) > self.max_entries)
+                   or (self.max_bytes is not None and self.size > self.max_bytes)):
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def stats(self):
+        """条目数、总大小（只在按字节限制时统计）、命中/未命中/淘汰次数和命中率"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class QBankEngine:
+    """可复用的转换引擎：持有跨题库共享的有界缓存，可在多个线程中同时转换不同题库
+    
+    MarkdownQBankConverter 只保存单个题库的解析结果和输出状态，渲染时通过引擎取用缓存：
+    markdown 为渲染后的Markdown（不含图片的文本），images 为本地图片的data URI（按路径、大小和修改时间），
+    templates 为预编译（及压缩后）的页面模板。各缓存的写入和淘汰分别加锁，缓存的值都不可变。
+    解析和渲染仍由转换器完成，引擎只提供缓存和 converter()/render()/write() 等便捷入口。
+    未指定引擎的转换器共用模块级的默认引擎。
+    """
+    
+    def __init__(self, markdown_entries=MARKDOWN_CACHE_SIZE, image_bytes=IMAGE_CACHE_BYTES,
+                 template_entries=TEMPLATE_CACHE_SIZE, policy='lru'):
+        self.markdown = BoundedCache(max_entries=markdown_entries, policy=policy)
+        # 值为 (data URI, 内容哈希)，按data URI长度计算大小
+        self.images = BoundedCache(max_bytes=image_bytes, policy=policy, sizeof=lambda value: len(value[0]))
+        self.templates = BoundedCache(max_entries=template_entries, policy=policy)
+    
+    def template(self, template, minify=False):
+        """取得预编译模板，同一模板内容只编译（和压缩）一次"""
+        import hashlib
+        
+        key = (hashlib.sha1(template.encode('utf-8')).hexdigest(), minify)
+        compiled = self.templates.get(key)
+        if compiled is None:
+            # 并发未命中时可能重复编译，结果相同，后放入的覆盖先放入的
+            compiled = CompiledTemplate(_minified_template(template) if minify else template)
+            self.templates.put(key, compiled)
+        return compiled
+    
+    def converter(self, md_file, **options):
+        """解析一个题库，返回使用本引擎缓存的转换器"""
+        return MarkdownQBankConverter(md_file, engine=self, **options)
+    
+    def render(self, md_file, **options):
+        """转换为HTML字符串"""
+        return self.converter(md_file, **options).convert()
+    
+    def write(self, md_file, html_file, **options):
+        """转换并写出HTML文件，返回转换统计"""
+        converter = self.converter(md_file, **options)
+        converter.write(html_file)
+        return converter.get_stats()
+    
+    def stats(self):
+        """各缓存的统计"""
+        return {name: getattr(self, name).stats() for name in ('markdown', 'images', 'templates')}
+    
+    def clear(self):
+        for name in ('markdown', 'images', 'templates'):
+            getattr(self, name).clear()
+
+
+# 未指定引擎的转换器共用的默认引擎
+_DEFAULT_ENGINE = QBankEngine()
 
 
 class MarkdownQBankConverter:
-    """Markdown题库转换器"""
+    """Markdown题库转换器
     
-    def __init__(self, md_file):
+    progress: 可选回调 progress(阶段, 已完成数, 总数)，总数未知时为None
+    cancel_event: 可选的threading.Event，置位后转换抛出ConversionCancelled
+    workers: 大于1时对大文件使用多进程分块解析、并发预取图片，结果与串行一致
+    minify: 输出压缩后的HTML（模板按内容哈希只压缩一次）
+    template: 自定义页面模板，槽位为 title/description/questions/total_count
+    shard: 分块输出（'section' 或每块题数），题目按需在页面中展开
+    shard_site: 分块写成 <输出名>_chunks/ 下的文件，由页面按需加载（需通过HTTP访问）
+    dedup: 重复的选项和解析只保存一份，页面加载时展开
+    fetch_images: 下载远程图片一并嵌入，image_cache 为磁盘缓存目录（默认 ~/.cache/md_qbank_to_html/images）
+    badges: 题目ID -> 题头标注的HTML（如 ItemAnalysis.badges() 的难度标注）
+    lazy_images: 图片数据放在页面末尾的表中，题目显示时才解码为object URL，离开后回收
+    pwa: 同时写出Web应用清单和Service Worker，通过HTTP访问时可安装、离线使用，更新时只下载变化的文件
+    index: 解析时同时写出源文件旁的字节偏移索引（见 QBankIndex），之后可直接读取单题或单个题型段落
+    engine: 提供共享缓存的 QBankEngine，默认使用模块级的默认引擎
+    """
+    
+    # 并行解析时每个分块的最小字节数，小文件直接串行解析
+    PARALLEL_MIN_CHUNK = 1 << 20
+    
+    def __init__(self, md_file, progress=None, cancel_event=None, workers=None, minify=False,
+                 template=None, shard=None, shard_site=False, dedup=False, fetch_images=False,
+                 image_cache=None, badges=None, lazy_images=False, pwa=False, index=False, engine=None):
+        self._init_state(md_file, progress, cancel_event, engine)
+        self._init_options(workers, minify, template, shard, shard_site, dedup, fetch_images, image_cache,
+                           badges, lazy_images, pwa)
+        
+        if index:
+            self._spans = []
+            st = self.md_file.stat()
+        self._parse()
+        if index:
+            self.source_index = QBankIndex(self.md_file).record(self, st)
+    
+    @classmethod
+    def from_questions(cls, questions, title="", description="", md_file=None,
+                       progress=None, cancel_event=None, engine=None, **options):
+        """不经解析，直接由已有题目（如题库数据库的查询结果）构造转换器"""
+        converter = cls.__new__(cls)
+        converter._init_state(md_file or Path.cwd() / 'questions.md', progress, cancel_event, engine)
+        converter._init_options(**options)
+        converter.title = title
+        converter.description = description
+        for q in questions:
+            converter.questions.append(q)
+            converter.stats['by_type'][q.type] = converter.stats['by_type'].get(q.type, 0) + 1
+        converter.stats['total'] = len(converter.questions)
+        return converter
+    
+    def _init_options(self, workers=None, minify=False, template=None, shard=None, shard_site=False,
+                      dedup=False, fetch_images=False, image_cache=None, badges=None, lazy_images=False,
+                      pwa=False):
+        """初始化输出选项"""
+        # workers > 1 时对大文件启用分块并行解析
+        self.workers = workers
+        # 压缩输出：静态模板和题目标记去掉缩进、换行和注释
+        self.minify = minify
+        # 页面模板（str.format语法），默认使用内置的HTML_TEMPLATE
+        self.template = template or HTML_TEMPLATE
+        # 分块输出：'section' 按题型段落，整数按固定题数；shard_site 时分块写成同目录文件
+        self.shard = shard
+        self.shard_site = shard_site
+        # 重复的选项和解析只在片段表中保存一份，题目中按序号引用
+        self.dedup = dedup
+        # 下载远程图片并嵌入页面（磁盘缓存，按ETag/Last-Modified重新验证）
+        self.remote_images = RemoteImageCache(image_cache) if fetch_images else None
+        # 题头标注（题目ID -> HTML），没有标注的题目输出不变
+        self.badges = badges or {}
+        # 图片按需解码：<img>只带占位尺寸，数据在页面末尾的图片表中
+        self.lazy_images = lazy_images
+        # PWA输出：页面旁写出清单和Service Worker（需通过HTTP访问）
+        self.pwa = pwa
+    
+    def _init_state(self, md_file, progress=None, cancel_event=None, engine=None):
+        """初始化解析状态"""
+        self.engine = engine or _DEFAULT_ENGINE
+        self.progress = progress
+        self.cancel_event = cancel_event
         self.md_file = Path(md_file)
         self.md_dir = self.md_file.parent
         self.title = ""
         self.description = ""
         self.questions = []
         self.stats = {'total': 0, 'by_type': {}}
-        
-        self._parse()
+        self._image_prefetch = {}  # src -> [Future, 剩余引用次数]
+        self._question_ids = None
+        self._fragment_index = {}  # 片段键 -> 片段表序号
+        # 页面依赖的图片：本地路径或URL -> 文件信息和内容哈希（写入构建清单）
+        self.image_dependencies = {}
+        self._image_table = []  # 按需解码模式的图片表（data URI）
+        self._image_slots = {}  # data URI -> (图片表序号, 尺寸)，不同写法的同一图片只保存一份
+        self._chunk_versions = []  # 站点模式下各分块文件的内容哈希
+        # 建索引时记录的行范围：('section', 题型, 行号) 和 ('question', 起始行, 结束行)，行号从0开始
+        self._spans = None
+        self.source_index = None
     
     def _parse(self):
         """解析Markdown文件"""
+        if self.workers and self.workers > 1 and self._parse_parallel():
+            return
+        
         with open(self.md_file, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        lines = content.split('\n')
-        i = 0
+        self._parse_lines(content.split('\n'))
+    
+    def _parse_parallel(self):
+        """分块并行解析：mmap源文件，在安全分割点切块后交给进程池
+        
+        分割点只选在顶格的标题行或顶格的题目行，它们在串行解析中必然结束上一题。
+        无法保证与串行解析结果一致时（如题库说明跨块）返回False，由调用方串行解析。
+        """
+        import mmap
+        from concurrent.futures import ProcessPoolExecutor
+        
+        size = self.md_file.stat().st_size
+        chunk_size = max(self.PARALLEL_MIN_CHUNK, size // (self.workers * 4))
+        if size < chunk_size * 2:
+            return False
+        
+        bounds = [0]
+        with open(self.md_file, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = chunk_size
+            while pos < size:
+                m = _SPLIT_POINT_RE.search(mm, pos)
+                if not m:
+                    break
+                bounds.append(m.end())
+                pos = m.end() + chunk_size
+        bounds.append(size)
+        if len(bounds) < 3:
+            return False
+        
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [pool.submit(_parse_chunk, str(self.md_file), start, end, self._spans is not None)
+                       for start, end in zip(bounds, bounds[1:])]
+            results = []
+            for n, future in enumerate(futures, 1):
+                results.append(future.result())
+                self._report('并行解析', n, len(futures))
+        finally:
+            pool.shutdown(cancel_futures=True)
+        
+        # 除最后一块外，块尾仍在收集题库说明则说明分割点不安全
+        if any(result['open_description'] for result in results[:-1]):
+            return False
+        
+        # 按顺序合并：块首尚未遇到题型标题的题目沿用上一块的题型
         current_qtype = ""
+        line_base = 0
+        for result in results:
+            if self._spans is not None:
+                for kind, *span in result['spans']:
+                    if kind == 'section':
+                        self._spans.append((kind, span[0], span[1] + line_base))
+                    else:
+                        self._spans.append((kind, span[0] + line_base, span[1] + line_base))
+                line_base += result['lines']
+            if result['has_title']:
+                self.title = result['title']
+                self.description = result['description']
+            for q in result['questions']:
+                if q.type == _CHUNK_QTYPE:
+                    q.type = sys.intern(current_qtype)
+                self.questions.append(q)
+            for qtype, count in result['by_type'].items():
+                if qtype == _CHUNK_QTYPE:
+                    qtype = current_qtype
+                self.stats['by_type'][qtype] = self.stats['by_type'].get(qtype, 0) + count
+            if result['qtype'] != _CHUNK_QTYPE:
+                current_qtype = result['qtype']
+        self.stats['total'] = len(self.questions)
+        return True
+    
+    def _parse_lines(self, lines, current_qtype=""):
+        """解析行列表，返回 (结束时的题型, 是否在收集题库说明时到达末尾)"""
+        i = 0
+        open_description = False
         
         while i < len(lines):
             line = lines[i].strip()
@@ -126,32 +980,51 @@ class MarkdownQBankConverter:
                         desc_lines.append(lines[i].strip())
                     i += 1
                 self.description = '\n'.join(desc_lines)
+                open_description = i >= len(lines)
                 continue
             
             # 二级标题：题型
             if line.startswith('## '):
                 current_qtype = line[3:].strip().replace('，', '').replace(',', '')
+                if self._spans is not None:
+                    self._spans.append(('section', current_qtype, i))
                 i += 1
                 continue
             
             # 题目（有序列表）
-            if re.match(r'^\d+\.\s+', line):
-                question = self._parse_question(lines, i, current_qtype)
-                if question:
+            if _ITEM_RE.match(line):
+                question, end_line = self._parse_question(lines, i, current_qtype)
+                if question is not None:
                     self.questions.append(question)
+                    if self._spans is not None:
+                        # 题目之后的空行不计入范围
+                        end = end_line
+                        while end > i + 1 and not lines[end - 1].strip():
+                            end -= 1
+                        self._spans.append(('question', i, end))
                     self.stats['total'] += 1
                     self.stats['by_type'][current_qtype] = self.stats['by_type'].get(current_qtype, 0) + 1
+                    self._report('解析题目', self.stats['total'], None)
                 # 跳过已处理的行
-                i = question.get('end_line', i + 1)
+                i = end_line
                 continue
             
             i += 1
+        
+        return current_qtype, open_description
+    
+    def _report(self, phase, done, total):
+        """报告进度并检查是否已取消"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ConversionCancelled()
+        if self.progress is not None:
+            self.progress(phase, done, total)
     
     def _parse_question(self, lines, start_idx, qtype):
-        """解析单个题目"""
-        match = re.match(r'^(\d+)\.\s+(.+)', lines[start_idx].strip())
+        """解析单个题目，返回 (Question, 结束行号)"""
+        match = _ITEM_PARTS_RE.match(lines[start_idx].strip())
         if not match:
-            return None
+            return None, start_idx + 1
         
         qid = match.group(1)
         stem = match.group(2)
@@ -164,7 +1037,7 @@ class MarkdownQBankConverter:
         while i < len(lines):
             line = lines[i].strip()
             # 遇到选项或下一题或标题，停止
-            if re.match(r'^\d+\.\s+', line) or line.startswith('#'):
+            if _ITEM_RE.match(line) or line.startswith('#'):
                 break
             if line:
                 stem_lines.append(line)
@@ -178,13 +1051,13 @@ class MarkdownQBankConverter:
             line = lines[i].strip()
             
             # 下一题或新标题，结束
-            if re.match(r'^\d+\.\s+', line) and not re.match(r'^\s+\d+\.\s+', lines[i]):
+            if _ITEM_RE.match(line) and not _INDENTED_ITEM_RE.match(lines[i]):
                 break
             if line.startswith('#'):
                 break
             
             # 选项（缩进的有序列表）
-            option_match = re.match(r'^(\d+)\.\s+(.+)', line)
+            option_match = _ITEM_PARTS_RE.match(line)
             if option_match and lines[i].startswith((' ', '\t')):
                 option_num = option_match.group(1)
                 option_text = option_match.group(2)
@@ -202,34 +1075,36 @@ class MarkdownQBankConverter:
                 # 移除正确答案标记
                 option_text = option_text.replace('==', '')
                 
-                options.append({
-                    'num': option_num,
-                    'text': option_text.strip(),
-                    'is_correct': is_correct,
-                    'explanation': explanation.strip()
-                })
+                options.append(Option(option_num, option_text.strip(),
+                                      is_correct, explanation.strip()))
             
             i += 1
         
-        return {
-            'id': qid,
-            'type': qtype,
-            'stem': stem,
-            'options': options,
-            'end_line': i
-        }
+        return Question(qid, qtype, stem, options), i
     
     def _process_markdown(self, text):
-        """处理Markdown内容：公式、图片、代码块等"""
+        """处理Markdown内容，相同文本的渲染结果在使用同一引擎的题库间共享缓存"""
         if not text:
             return ""
         
+        html = self.engine.markdown.get(text)
+        if html is not None:
+            return html
+        
+        html = self._render_markdown(text)
+        # 含图片的文本与题库目录和图片表有关，不缓存（图片本身由引擎的图片缓存复用）
+        if '![' not in text:
+            self.engine.markdown.put(text, html)
+        return html
+    
+    def _render_markdown(self, text):
+        """处理Markdown内容：公式、图片、代码块等"""
         # 先处理代码块（避免代码块内的特殊字符被处理）
         code_blocks = []
         def save_code(m):
             code_blocks.append(m.group(0))
             return f"<<<CODE{len(code_blocks)-1}>>>"
-        text = re.sub(r'```(\w*)\n(.*?)```', save_code, text, flags=re.DOTALL)
+        text = _CODE_BLOCK_RE.sub(save_code, text)
         
         # 保存公式（避免公式内的特殊字符被处理）
         formulas = []
@@ -238,35 +1113,26 @@ class MarkdownQBankConverter:
             return f"<<<MATH{len(formulas)-1}>>>"
         
         # 处理块级公式 $$...$$
-        text = re.sub(r'\$\$\s*\n?(.*?)\n?\s*\$\$', save_formula, text, flags=re.DOTALL)
+        text = _BLOCK_MATH_RE.sub(save_formula, text)
         # 处理行内公式 $...$
-        text = re.sub(r'\$([^$\n]+)\$', save_formula, text)
+        text = _INLINE_MATH_RE.sub(save_formula, text)
         
         # 处理图片
-        text = re.sub(
-            r'!\[([^\]]*)\]\(([^)]+)\)',
+        text = _IMAGE_RE.sub(
             lambda m: self._embed_image(m.group(1), m.group(2)),
             text
         )
         
-        # 处理Markdown基本语法
-        # 粗体 **text** 或 __text__
-        text = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', text)
-        text = re.sub(r'__(.+?)__', r'<strong>\1</strong>', text)
-        
-        # 斜体 *text* 或 _text_
-        text = re.sub(r'\*(.+?)\*', r'<em>\1</em>', text)
-        text = re.sub(r'_(.+?)_', r'<em>\1</em>', text)
-        
-        # 行内代码 `code`
-        text = re.sub(r'`([^`]+)`', r'<code>\1</code>', text)
+        # 处理Markdown基本语法：粗体、斜体、行内代码
+        for pattern, replacement in _INLINE_MARKUP_RULES:
+            text = pattern.sub(replacement, text)
         
         # 处理换行：连续两个换行为段落，单个换行为<br>
         text = text.replace('\n\n', '</p><p>')
         text = text.replace('\n', '<br>')
         text = '<p>' + text + '</p>'
         # 清理多余的空段落
-        text = re.sub(r'<p>\s*</p>', '', text)
+        text = _EMPTY_PARAGRAPH_RE.sub('', text)
         
         # 恢复公式
         for i, formula in enumerate(formulas):
@@ -280,7 +1146,7 @@ class MarkdownQBankConverter:
         # 恢复代码块
         for i, code in enumerate(code_blocks):
             placeholder = f"<<<CODE{i}>>>"
-            match = re.match(r'```(\w*)\n(.*?)```', code, re.DOTALL)
+            match = _CODE_BLOCK_RE.match(code)
             if match:
                 lang = match.group(1)
                 code_content = self._escape_html(match.group(2))
@@ -299,105 +1165,1473 @@ class MarkdownQBankConverter:
     
     def _embed_image(self, alt, src):
         """嵌入图片为base64"""
+        # 远程图片：启用下载时嵌入，下载失败（且无缓存）时保留原链接
+        if self.remote_images is not None and src.startswith(('http://', 'https://')):
+            try:
+                data_uri, _ = self._take_image(src)
+            except Exception:
+                data_uri = None
+            if data_uri is not None:
+                return self._image_tag(alt, data_uri)
+        
         # 处理相对路径
         if not src.startswith(('http://', 'https://', 'data:')):
-            # URL解码，处理%E6%B5%8B%E8%AF%95等编码的中文
-            src_decoded = unquote(src)
-            img_path = self.md_dir / src_decoded.lstrip('./')
-            
-            # 如果解码后的路径不存在，尝试原始路径
-            if not img_path.exists():
-                img_path = self.md_dir / src.lstrip('./')
-            
-            if img_path.exists():
-                try:
-                    with open(img_path, 'rb') as f:
-                        img_data = f.read()
-                    mime_type = mimetypes.guess_type(str(img_path))[0] or 'image/jpeg'
-                    b64_data = base64.b64encode(img_data).decode('utf-8')
-                    return f'<img src="data:{mime_type};base64,{b64_data}" alt="{alt}" />'
-                except Exception as e:
-                    return f'<span class="img-error">[图片加载失败: {alt} - {str(e)}]</span>'
-            else:
+            try:
+                data_uri, src_decoded = self._take_image(src)
+            except Exception as e:
+                return f'<span class="img-error">[图片加载失败: {alt} - {str(e)}]</span>'
+            if data_uri is None:
                 return f'<span class="img-error">[图片文件不存在: {src_decoded}]</span>'
+            return self._image_tag(alt, data_uri)
         
         return f'<img src="{src}" alt="{alt}" />'
     
+    def _image_tag(self, alt, data_uri):
+        """嵌入图片的<img>：按需解码模式下只输出图片表序号和占位尺寸"""
+        if not self.lazy_images:
+            return f'<img src="{data_uri}" alt="{alt}" />'
+        
+        slot = self._image_slots.get(data_uri)
+        if slot is None:
+            start = data_uri.index(',') + 1
+            # 尺寸信息在文件头部（JPEG可能在较大的EXIF之后），先只解码开头一段
+            size = _image_size(base64.b64decode(data_uri[start:start + (1 << 16)]))
+            if size is None and len(data_uri) - start > 1 << 16:
+                size = _image_size(base64.b64decode(data_uri[start:]))
+            slot = self._image_slots[data_uri] = (len(self._image_table), size)
+            self._image_table.append(data_uri)
+        
+        index, size = slot
+        size_attrs = f' width="{size[0]}" height="{size[1]}"' if size else ''
+        return f'<img data-img="{index}" alt="{alt}"{size_attrs} />'
+    
+    def _iter_image_table(self):
+        """按需解码模式：在所有题目之后输出图片表（此时所有图片都已登记）"""
+        if self._image_table:
+            yield f'<script type="application/json" id="qbank-images">{_json_for_script(self._image_table)}</script>\n'
+    
+    def _take_image(self, src):
+        """取得图片的data URI：优先使用预取结果，否则同步读取"""
+        entry = self._image_prefetch.get(src)
+        if entry is None:
+            return self._load_image(src)
+        # 引用计数归零后释放预取结果，避免所有图片同时驻留内存
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._image_prefetch[src]
+        return entry[0].result()
+    
+    def _load_image(self, src):
+        """读取本地图片，返回 (data URI，文件不存在时为None, URL解码后的路径)"""
+        if src.startswith(('http://', 'https://')):
+            data_uri = self.remote_images.data_uri(src)
+            self._record_image(src, data_uri.encode('ascii') if data_uri is not None else None)
+            return data_uri, src
+        
+        # URL解码，处理%E6%B5%8B%E8%AF%95等编码的中文
+        src_decoded = unquote(src)
+        img_path = self.md_dir / src_decoded.lstrip('./')
+        
+        # 如果解码后的路径不存在，尝试原始路径
+        if not img_path.exists():
+            img_path = self.md_dir / src.lstrip('./')
+        # 最后尝试绝对路径（如题库数据库中改写过的图片路径）
+        if not img_path.exists() and Path(src_decoded).is_absolute():
+            img_path = Path(src_decoded)
+        if not img_path.exists():
+            # 不存在的图片也记为依赖，图片补上后需要重建
+            self._record_image(str((self.md_dir / src_decoded.lstrip('./')).resolve()), None)
+            return None, src_decoded
+        
+        # 引擎按 (路径, 大小, 修改时间) 缓存编码结果，文件改动后自然失效
+        path = str(img_path.resolve())
+        st = img_path.stat()
+        cached = self.engine.images.get((path, st.st_size, st.st_mtime_ns))
+        if cached is None:
+            import hashlib
+            
+            with open(img_path, 'rb') as f:
+                img_data = f.read()
+                st = os.fstat(f.fileno())
+            mime_type = mimetypes.guess_type(str(img_path))[0] or 'image/jpeg'
+            b64_data = base64.b64encode(img_data).decode('utf-8')
+            cached = (f'data:{mime_type};base64,{b64_data}', hashlib.sha256(img_data).hexdigest())
+            self.engine.images.put((path, st.st_size, st.st_mtime_ns), cached)
+        data_uri, digest = cached
+        self._record_image(path, None, st, digest)
+        return data_uri, src_decoded
+    
+    def _record_image(self, key, data, st=None, digest=None):
+        """记录页面依赖的图片（data和digest都为None表示图片不存在或下载失败）"""
+        import hashlib
+        
+        if digest is None and data is not None:
+            digest = hashlib.sha256(data).hexdigest()
+        entry = {'sha256': digest}
+        if st is not None:
+            entry['size'] = st.st_size
+            entry['mtime_ns'] = st.st_mtime_ns
+        self.image_dependencies[key] = entry
+    
+    def _prefetch_images(self, executor, remote_executor=None):
+        """扫描所有题目引用的图片，本地图片提交到线程池并发读取和编码，远程图片提交到下载线程池"""
+        texts = [self.description]
+        for q in self.questions:
+            texts.append(q.stem)
+            for opt in q.options:
+                texts.append(opt.text)
+                texts.append(opt.explanation)
+        
+        for text in texts:
+            if '![' not in text:
+                continue
+            # 代码块中的图片语法不会被渲染为图片，与渲染时一样先去掉代码块再计数
+            if '```' in text:
+                text = _CODE_BLOCK_RE.sub('', text)
+            for m in _IMAGE_RE.finditer(text):
+                src = m.group(2)
+                if src.startswith('data:'):
+                    continue
+                pool = remote_executor if src.startswith(('http://', 'https://')) else executor
+                if pool is None:
+                    continue
+                entry = self._image_prefetch.get(src)
+                if entry is None:
+                    self._image_prefetch[src] = [pool.submit(self._load_image, src), 1]
+                else:
+                    entry[1] += 1
+    
+    def _iter_questions_html(self, start=0, end=None):
+        """逐题生成HTML，使用全局连续编号"""
+        total = len(self.questions)
+        end = total if end is None else end
+        qids = self.question_ids()
+        for global_index in range(start + 1, end + 1):
+            yield self._generate_question_html(self.questions[global_index - 1], global_index,
+                                               qids[global_index - 1])
+            self._report('生成页面', global_index, total)
+    
+    def question_ids(self):
+        """每题的稳定ID（内容哈希，题目顺序变化时不变），构建时检查冲突：
+        内容相同的重复题追加序号，内容不同但哈希前缀相同时改用完整哈希"""
+        if self._question_ids is not None and len(self._question_ids) == len(self.questions):
+            return self._question_ids
+        
+        ids = []
+        seen = {}         # ID -> 完整哈希
+        duplicates = {}   # ID -> 出现次数
+        for q in self.questions:
+            full = question_content_id(q, length=None)
+            qid = full[:QUESTION_ID_LENGTH]
+            if seen.get(qid, full) != full:
+                qid = full
+            if qid in seen:
+                duplicates[qid] = duplicates.get(qid, 1) + 1
+                qid = f'{qid}-{duplicates[qid]}'
+            seen[qid] = full
+            ids.append(qid)
+        self._question_ids = ids
+        return ids
+    
+    @staticmethod
+    def _fragment_keys(opt):
+        """选项文本和解析在片段表中的键（解析的标签与是否正确答案有关）"""
+        return ('option', opt.text), ('explanation', opt.is_correct, opt.explanation)
+    
+    def _explanation_html(self, is_correct, explanation_html):
+        """解析区块的内部HTML：正确/错误标签 + 解析内容"""
+        icon = '✅ 正确' if is_correct else '❌ 错误'
+        return f'<span class="exp-icon">{icon}</span> {explanation_html}'
+    
+    def _build_fragment_table(self):
+        """统计重复出现的选项和解析，各渲染一次放入片段表，返回片段HTML列表"""
+        counts = {}
+        for q in self.questions:
+            for opt in q.options:
+                option_key, explanation_key = self._fragment_keys(opt)
+                counts[option_key] = counts.get(option_key, 0) + 1
+                if opt.explanation:
+                    counts[explanation_key] = counts.get(explanation_key, 0) + 1
+        
+        table = []
+        self._fragment_index = {}
+        for key, count in counts.items():
+            if count < 2:
+                continue
+            if key[0] == 'option':
+                html = self._process_markdown(key[1])
+            else:
+                html = self._explanation_html(key[1], self._process_markdown(key[2]))
+            # 引用本身约占十几个字节，太短的片段直接内联
+            if len(html) < FRAGMENT_MIN_LENGTH:
+                continue
+            self._fragment_index[key] = len(table)
+            table.append(html)
+        
+        self.stats['fragments'] = {
+            'total': sum(counts.values()),
+            'unique': len(counts),
+            'table': len(table),
+            'references': sum(counts[key] for key in self._fragment_index),
+        }
+        return table
+    
+    def _iter_question_batches(self, batch_size=1 << 16, html_file=None):
+        """把逐题HTML合并成约64KB的批次，便于流式写出"""
+        parts = self._iter_sharded_html(html_file) if self.shard else self._iter_questions_html()
+        if self.pwa:
+            if html_file is None:
+                raise ValueError("PWA输出需要通过write()写出")
+            parts = itertools.chain((self._pwa_config(html_file),), parts)
+        if self.dedup:
+            table = self._build_fragment_table()
+            head = f'<script type="application/json" id="qbank-fragments">{_json_for_script(table)}</script>\n'
+            parts = itertools.chain((head,), parts)
+        if self.lazy_images:
+            parts = itertools.chain(parts, self._iter_image_table())
+        batch, size = [], 0
+        for html in parts:
+            batch.append(html)
+            size += len(html)
+            if size >= batch_size:
+                yield ''.join(batch)
+                batch, size = [], 0
+        if batch:
+            yield ''.join(batch)
+    
+    def _shard_ranges(self):
+        """分块范围 [(起始序号, 结束序号)]：按题型段落或按固定题数"""
+        total = len(self.questions)
+        if self.shard == 'section':
+            ranges = []
+            start = 0
+            for i in range(1, total + 1):
+                if i == total or self.questions[i].type != self.questions[start].type:
+                    ranges.append((start, i))
+                    start = i
+            return ranges
+        size = int(self.shard)
+        return [(start, min(start + size, total)) for start in range(0, total, size)]
+    
+    def _iter_sharded_html(self, html_file=None):
+        """分块输出：每题只输出占位节点，题目HTML按块放入惰性<script>（站点模式下写成同目录文件）"""
+        import hashlib
+        
+        ranges = self._shard_ranges()
+        chunk_dir = None
+        if self.shard_site:
+            if html_file is None:
+                raise ValueError("站点模式的分块文件需要通过write()写出")
+            chunk_dir = Path(html_file).with_name(Path(html_file).stem + '_chunks')
+            chunk_dir.mkdir(parents=True, exist_ok=True)
+        
+        config = {
+            'starts': [start for start, _ in ranges],
+            'base': f'{chunk_dir.name}/chunk-' if chunk_dir else None,
+        }
+        yield f'<script type="application/json" id="qbank-shards">{_json_for_script(config)}</script>\n'
+        
+        # 搜索索引：题号、题型和题目原文（小写），不必展开分块即可全文搜索
+        search = []
+        for global_index, q in enumerate(self.questions, 1):
+            texts = [f'第 {global_index} 题 [{q.type}]', q.stem]
+            for opt in q.options:
+                texts.append(opt.text)
+                texts.append(opt.explanation)
+            search.append(' '.join(texts).lower())
+        yield f'<script type="application/json" id="qbank-search">{_json_for_script(search)}</script>\n'
+        
+        qids = self.question_ids()
+        for k, (start, end) in enumerate(ranges):
+            for i in range(start, end):
+                q = self.questions[i]
+                yield (f'<div class="question q-stub" data-qid="{qids[i]}" data-type="{q.type}" data-chunk="{k}" '
+                       f'data-answered="false" data-correct="false" data-auto-wrong="false" data-mark-important="false"></div>\n')
+        
+        self._chunk_versions = []
+        for k, (start, end) in enumerate(ranges):
+            chunk_html = ''.join(self._iter_questions_html(start, end))
+            if chunk_dir is not None:
+                data = chunk_html.encode('utf-8')
+                (chunk_dir / f'chunk-{k}.html').write_bytes(data)
+                self._chunk_versions.append(hashlib.sha256(data).hexdigest()[:12])
+            else:
+                # 题目内容中的 </script（不区分大小写）需要转义，页面展开时再还原
+                chunk_html = _CHUNK_SCRIPT_END_RE.sub(r'<\\/\1', chunk_html)
+                yield f'<script type="text/x-qbank-chunk" id="qbank-chunk-{k}">{chunk_html}</script>\n'
+        
+        # 分块文件按内容哈希加版本参数：内容不变的分块地址不变，可以继续使用浏览器和离线缓存
+        if chunk_dir is not None:
+            # 重新构建后分块变少时，删除上次留下的多余分块文件
+            written = {f'chunk-{k}.html' for k in range(len(ranges))}
+            for path in chunk_dir.glob('chunk-*.html'):
+                if path.name not in written:
+                    path.unlink()
+            yield (f'<script type="application/json" id="qbank-chunk-versions">'
+                   f'{_json_for_script(self._chunk_versions)}</script>\n')
+    
+    @staticmethod
+    def _pwa_files(html_file):
+        """PWA输出的文件：(Web应用清单, Service Worker, 图标)，与页面在同一目录"""
+        html_file = Path(html_file)
+        return (html_file.with_name(html_file.stem + '.webmanifest'),
+                html_file.with_name(html_file.stem + '.sw.js'),
+                html_file.with_name('qbank-icon.svg'))
+    
+    @staticmethod
+    def _versioned(path, base):
+        """相对base目录的地址，带内容哈希版本参数"""
+        return f'{Path(path).relative_to(base).as_posix()}?v={QBankStore._file_hash(path)[:12]}'
+    
+    def _pwa_config(self, html_file):
+        """写出Web应用清单和图标，返回页面中注册Service Worker的配置"""
+        import json
+        
+        html_file = Path(html_file)
+        manifest_file, sw_file, icon_file = self._pwa_files(html_file)
+        icon_file.write_text(PWA_ICON, encoding='utf-8')
+        title = self.title or "题库"
+        manifest_file.write_text(json.dumps({
+            'name': title,
+            'short_name': title[:12],
+            'start_url': f'./{html_file.name}',
+            'scope': './',
+            'display': 'standalone',
+            'background_color': '#f5f7fa',
+            'theme_color': '#667eea',
+            'icons': [{'src': self._versioned(icon_file, html_file.parent), 'sizes': 'any', 'type': 'image/svg+xml'}],
+        }, ensure_ascii=False, indent=1), encoding='utf-8')
+        
+        config = {
+            'sw': sw_file.name,
+            # 每个题库的Service Worker只控制自己的页面，同目录的多个题库互不影响
+            'scope': f'./{html_file.name}',
+            'manifest': self._versioned(manifest_file, html_file.parent),
+        }
+        return f'<script type="application/json" id="qbank-pwa">{_json_for_script(config)}</script>\n'
+    
+    def _write_service_worker(self, html_file):
+        """写出Service Worker：预缓存页面、清单、图标和分块文件（地址带内容哈希），及页面引用的CDN运行库"""
+        import hashlib
+        import json
+        
+        html_file = Path(html_file)
+        base = html_file.parent
+        manifest_file, sw_file, icon_file = self._pwa_files(html_file)
+        precache = [self._versioned(path, base) for path in (html_file, manifest_file, icon_file)]
+        if self.shard_site:
+            chunk_dir = html_file.with_name(html_file.stem + '_chunks')
+            precache += [f'{chunk_dir.name}/chunk-{k}.html?v={version}'
+                         for k, version in enumerate(self._chunk_versions)]
+        
+        config = {
+            'name': html_file.stem,
+            'version': hashlib.sha256('\n'.join(precache).encode('utf-8')).hexdigest()[:12],
+            'page': precache[0],
+            'precache': precache,
+            'runtime': sorted(set(re.findall(r'(?:src|href)="(https://[^"]+)"', self.template))),
+        }
+        sw_file.write_text(SERVICE_WORKER_TEMPLATE.format(config=json.dumps(config, ensure_ascii=False, indent=1)),
+                           encoding='utf-8')
+    
+    def _template_values(self, questions):
+        """页面模板各槽位的内容，questions可以是字符串或生成器"""
+        return {
+            'title': self.title or "题库",
+            'description': self._process_markdown(self.description) if self.description else "",
+            'questions': questions,
+            'total_count': self.stats['total'],
+        }
+    
+    def _page_template(self):
+        """取得（引擎缓存的）预编译页面模板"""
+        return self.engine.template(self.template, minify=self.minify)
+    
     def convert(self):
         """转换为HTML"""
-        # 生成题目HTML，使用全局连续编号
-        questions_html = ""
-        for global_index, q in enumerate(self.questions, 1):
-            questions_html += self._generate_question_html(q, global_index)
-        
-        # 使用模板
-        html = HTML_TEMPLATE.format(
-            title=self.title or "题库",
-            description=self._process_markdown(self.description) if self.description else "",
-            questions=questions_html,
-            total_count=self.stats['total']
-        )
-        
-        return html
+        try:
+            return self._page_template().render(**self._template_values(self._iter_question_batches()))
+        finally:
+            if self.remote_images is not None:
+                self.remote_images.close()
     
-    def _generate_question_html(self, q, global_num=None):
+    def write(self, html_file):
+        """流水线写出HTML文件
+        
+        workers > 1 时图片在线程池中并发预取和编码，与题目渲染重叠进行；
+        模板静态片段和渲染好的题目批次依次交给写线程，边生成边写入磁盘。
+        """
+        import queue
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        
+        workers = self.workers or 1
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        remote_executor = None
+        if self.remote_images is not None:
+            remote_executor = ThreadPoolExecutor(max_workers=self.remote_images.max_connections)
+        chunks = queue.Queue(maxsize=64)
+        errors = []
+        # 先写入同目录的临时文件，成功后再替换，失败时保留上一次的完整页面
+        tmp_file = Path(html_file).with_name(Path(html_file).name + '.tmp')
+        
+        def writer():
+            try:
+                with open(tmp_file, 'wb') as f:
+                    while True:
+                        chunk = chunks.get()
+                        if chunk is None:
+                            return
+                        f.write(chunk)
+            except Exception as e:
+                errors.append(e)
+                # 继续取空队列，避免生产者阻塞
+                while chunks.get() is not None:
+                    pass
+        
+        writer_thread = threading.Thread(target=writer, daemon=True)
+        writer_thread.start()
+        ok = False
+        try:
+            if executor is not None or remote_executor is not None:
+                self._prefetch_images(executor, remote_executor)
+            values = self._template_values(self._iter_question_batches(html_file=html_file))
+            for chunk in self._page_template().iter_bytes(**values):
+                chunks.put(chunk)
+                if errors:
+                    break
+            ok = True
+        finally:
+            chunks.put(None)
+            writer_thread.join()
+            for pool in (executor, remote_executor):
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+            if self.remote_images is not None:
+                self.remote_images.close()
+            self._image_prefetch.clear()
+            if errors or not ok:
+                # 失败或取消时只删除临时文件，不留下不完整的页面
+                tmp_file.unlink(missing_ok=True)
+        if errors:
+            raise errors[0]
+        os.replace(tmp_file, html_file)
+        if self.pwa:
+            self._write_service_worker(html_file)
+    
+    def _generate_question_html(self, q, global_num=None, qid=None):
         """生成单个题目的HTML"""
-        stem_html = self._process_markdown(q['stem'])
-        qtype = q['type']
+        stem_html = self._process_markdown(q.stem)
+        qtype = q.type
         is_multiple = '多选' in qtype
         is_judge = '判断' in qtype
         
         # 使用全局编号，如果没有则使用原始编号
-        display_num = global_num if global_num else q['id']
+        display_num = global_num if global_num else q.id
+        
+        # 页面和进度存储使用的稳定ID
+        qid = qid or question_content_id(q)
         
         # 单选和判断题不需要提交按钮，点击直接显示
         need_submit = is_multiple
         
-        html = f'''
-<div class="question" data-qid="{q['id']}" data-type="{qtype}" data-answered="false" data-correct="false" data-auto-wrong="false" data-mark-important="false">
+        # 压缩模式使用去掉缩进和换行的题目片段
+        fragments = _MINIFIED_QUESTION_FRAGMENTS if self.minify else QUESTION_FRAGMENTS
+        
+        html = fragments['head'].format(
+            qid=qid, qtype=qtype, display_num=display_num, stem_html=stem_html,
+            badge_html=self.badges.get(qid, ''))
+        
+        # 生成选项
+        fragment_index = self._fragment_index
+        for idx, opt in enumerate(q.options):
+            option_key, explanation_key = self._fragment_keys(opt) if fragment_index else (None, None)
+            
+            # 片段表中已有的选项只输出引用，由页面展开
+            option_attrs = ''
+            if option_key in fragment_index:
+                option_attrs = f' data-frag="{fragment_index[option_key]}"'
+                option_html = ''
+            else:
+                option_html = self._process_markdown(opt.text)
+            
+            input_type = 'checkbox' if is_multiple else 'radio'
+            correct_class = 'correct-option' if opt.is_correct else ''
+            
+            # 根据是否正确答案，添加不同的解析标签
+            exp_class = 'correct-exp' if opt.is_correct else 'wrong-exp'
+            if not opt.explanation:
+                explanation_content = ''
+            elif explanation_key in fragment_index:
+                explanation_content = f'<div class="explanation {exp_class}" data-frag="{fragment_index[explanation_key]}"></div>'
+            else:
+                explanation_html = self._explanation_html(opt.is_correct, self._process_markdown(opt.explanation))
+                explanation_content = f'<div class="explanation {exp_class}">{explanation_html}</div>'
+            
+            html += fragments['option'].format(
+                correct_class=correct_class,
+                is_correct=str(opt.is_correct).lower(),
+                option_click='' if is_multiple else 'selectSingleOption(this)',
+                input_type=input_type,
+                qid=qid,
+                idx=idx,
+                input_click='' if is_multiple else 'onclick="event.stopPropagation()"',
+                label=idx + 1,
+                option_attrs=option_attrs,
+                option_html=option_html,
+                explanation_content=explanation_content)
+        
+        # 多选题需要提交按钮
+        if need_submit:
+            html += fragments['tail_submit']
+        else:
+            html += fragments['tail']
+        
+        return html
+    
+    def __iter__(self):
+        """按全局顺序遍历题目（Question对象）"""
+        return iter(self.questions)
+    
+    def __len__(self):
+        return len(self.questions)
+    
+    def _dedup_ratio(self):
+        """本题库内题干、选项和解析文本与前文重复的比例"""
+        seen = set()
+        total = 0
+        for q in self.questions:
+            texts = [q.stem]
+            for opt in q.options:
+                texts.append(opt.text)
+                texts.append(opt.explanation)
+            for text in texts:
+                if text:
+                    total += 1
+                    seen.add(text)
+        return (total - len(seen)) / total if total else 0.0
+    
+    def get_stats(self):
+        """获取统计信息"""
+        return {
+            'title': self.title,
+            'total': self.stats['total'],
+            'by_type': self.stats['by_type'],
+            'dedup_ratio': self._dedup_ratio(),
+            'fragments': self.stats.get('fragments'),
+            'remote_images': dict(self.remote_images.stats) if self.remote_images is not None else None,
+        }
+
+
+class QBankStore:
+    """题库数据库：SQLite保存解析后的题目，FTS5全文索引，按文件哈希增量更新"""
+    
+    STATUS_TEXT = {'added': "已导入", 'updated': "已更新", 'unchanged': "未变化"}
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS banks (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            md_dir TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY,
+            bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
+            ordinal INTEGER NOT NULL,
+            qid TEXT NOT NULL,
+            type TEXT NOT NULL,
+            stem TEXT NOT NULL,
+            options TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS questions_bank ON questions(bank_id, ordinal);
+        CREATE INDEX IF NOT EXISTS questions_type ON questions(type);
+    '''
+    
+    def __init__(self, db_path):
+        import sqlite3
+        
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(self.SCHEMA)
+        # trigram分词支持中文子串检索（SQLite 3.34+），否则退回unicode61
+        try:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts "
+                              "USING fts5(stem, options, tokenize='trigram')")
+            self.trigram = True
+        except sqlite3.OperationalError:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(stem, options)")
+            self.trigram = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        self.conn.close()
+    
+    @staticmethod
+    def _file_hash(path):
+        import hashlib
+        
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def ingest(self, md_file, workers=None):
+        """导入一个题库：大小和修改时间未变时直接跳过，内容哈希未变时只更新文件信息"""
+        import json
+        
+        path = Path(md_file).resolve()
+        st = path.stat()
+        row = self.conn.execute('SELECT id, sha256, size, mtime FROM banks WHERE path = ?',
+                                (str(path),)).fetchone()
+        if row and row[2] == st.st_size and row[3] == st.st_mtime:
+            return 'unchanged'
+        
+        sha256 = self._file_hash(path)
+        if row and row[1] == sha256:
+            with self.conn:
+                self.conn.execute('UPDATE banks SET size = ?, mtime = ? WHERE id = ?',
+                                  (st.st_size, st.st_mtime, row[0]))
+            return 'unchanged'
+        
+        converter = MarkdownQBankConverter(path, workers=workers)
+        with self.conn:
+            if row:
+                self.conn.execute('DELETE FROM questions_fts WHERE rowid IN '
+                                  '(SELECT id FROM questions WHERE bank_id = ?)', (row[0],))
+                self.conn.execute('DELETE FROM questions WHERE bank_id = ?', (row[0],))
+                self.conn.execute('UPDATE banks SET sha256 = ?, size = ?, mtime = ?, title = ?, description = ? '
+                                  'WHERE id = ?', (sha256, st.st_size, st.st_mtime, converter.title,
+                                                   converter.description, row[0]))
+                bank_id = row[0]
+            else:
+                bank_id = self.conn.execute(
+                    'INSERT INTO banks (path, md_dir, sha256, size, mtime, title, description) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (str(path), str(path.parent), sha256, st.st_size, st.st_mtime,
+                     converter.title, converter.description)).lastrowid
+            
+            for ordinal, q in enumerate(converter.questions):
+                options = [[opt.num, opt.text, opt.is_correct, opt.explanation] for opt in q.options]
+                rowid = self.conn.execute(
+                    'INSERT INTO questions (bank_id, ordinal, qid, type, stem, options) VALUES (?, ?, ?, ?, ?, ?)',
+                    (bank_id, ordinal, q.id, q.type, q.stem, json.dumps(options, ensure_ascii=False))).lastrowid
+                options_text = '\n'.join(f'{opt.text}\n{opt.explanation}' for opt in q.options)
+                self.conn.execute('INSERT INTO questions_fts (rowid, stem, options) VALUES (?, ?, ?)',
+                                  (rowid, q.stem, options_text))
+        return 'updated' if row else 'added'
+    
+    def search(self, text=None, types=None, bank=None, limit=None, sample=False, seed=None):
+        """检索题目，返回 [(题库标题, Question)]；图片路径改写为绝对路径，生成HTML时无需原题库目录"""
+        import json
+        import random
+        
+        where, params = [], []
+        if text:
+            if self.trigram and len(text) >= 3:
+                where.append('q.id IN (SELECT rowid FROM questions_fts WHERE questions_fts MATCH ?)')
+                params.append('"' + text.replace('"', '""') + '"')
+            else:
+                # trigram索引不支持少于3个字的检索，退回子串匹配
+                where.append('(q.stem LIKE ? OR q.options LIKE ?)')
+                params += [f'%{text}%'] * 2
+        if types:
+            where.append('(' + ' OR '.join('q.type LIKE ?' for _ in types) + ')')
+            params += [f'%{t}%' for t in types]
+        if bank:
+            where.append('b.path LIKE ?')
+            params.append(f'%{bank}%')
+        
+        sql = ('SELECT b.title, b.md_dir, q.qid, q.type, q.stem, q.options, q.id '
+               'FROM questions q JOIN banks b ON b.id = q.bank_id')
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY b.path, q.ordinal'
+        if limit and not sample:
+            sql += f' LIMIT {int(limit)}'
+        rows = self.conn.execute(sql, params).fetchall()
+        
+        if sample and limit and len(rows) > limit:
+            rows = random.Random(seed).sample(rows, limit)
+        
+        results = []
+        for title, md_dir, qid, qtype, stem, options_json, rowid in rows:
+            def absolute(text):
+                return _IMAGE_RE.sub(lambda m: self._absolute_image(m, md_dir), text) if '![' in text else text
+            options = [Option(num, absolute(opt_text), is_correct, absolute(explanation))
+                       for num, opt_text, is_correct, explanation in json.loads(options_json)]
+            results.append((title, Question(qid, qtype, absolute(stem), options)))
+        return results
+    
+    @staticmethod
+    def _absolute_image(m, md_dir):
+        """把相对图片路径改写为题库目录下的绝对路径"""
+        from urllib.parse import quote
+        
+        src = m.group(2)
+        if src.startswith(('http://', 'https://', 'data:')):
+            return m.group(0)
+        path = Path(md_dir) / unquote(src).lstrip('./')
+        return f'![{m.group(1)}]({quote(path.as_posix())})'
+    
+    def to_converter(self, rows, title, **options):
+        """由检索结果构造转换器，直接生成HTML"""
+        return MarkdownQBankConverter.from_questions([q for _, q in rows], title=title, **options)
+
+
+class ExamGenerator:
+    """批量生成随机试卷
+    
+    每个学生的随机种子由试卷种子和学生编号决定，同一编号重新生成得到同一份试卷；
+    每份试卷抽取count道题（保持题库中的题型顺序），除判断题外打乱选项，并给出对应答案。
+    被抽中题目的题干和选项HTML只渲染一次，所有试卷共用，再在线程池中并发拼装和写出。
+    """
+    
+    def __init__(self, converter, count, seed='0', shuffle_options=True, workers=None, title=None):
+        if count <= 0:
+            raise ValueError("每份试卷的题数必须为正数")
+        self.converter = converter
+        self.count = min(count, len(converter.questions))
+        self.seed = str(seed)
+        self.shuffle_options = shuffle_options
+        self.workers = workers
+        self.title = title or converter.title or "试卷"
+        self._fragments = {}  # 题目序号 -> (题干HTML, [选项HTML])
+    
+    def student_seed(self, student):
+        """学生的随机种子"""
+        import hashlib
+        
+        return int(hashlib.sha256(f'{self.seed}:{student}'.encode('utf-8')).hexdigest()[:16], 16)
+    
+    def variant(self, student):
+        """抽题和选项顺序：[(题目序号, 选项原序号列表)]"""
+        import random
+        
+        rng = random.Random(self.student_seed(student))
+        questions = self.converter.questions
+        items = []
+        for i in sorted(rng.sample(range(len(questions)), self.count)):
+            order = list(range(len(questions[i].options)))
+            if self.shuffle_options and '判断' not in questions[i].type:
+                rng.shuffle(order)
+            items.append((i, order))
+        return items
+    
+    @staticmethod
+    def answer_of(question, order):
+        """打乱后的正确选项字母，如 AC"""
+        return ''.join(chr(ord('A') + k) for k, orig in enumerate(order) if question.options[orig].is_correct)
+    
+    def _render_fragments(self, ordinals):
+        """渲染被抽中题目的题干和选项（每题只渲染一次）"""
+        process = self.converter._process_markdown
+        for i in sorted(ordinals):
+            if i in self._fragments:
+                continue
+            q = self.converter.questions[i]
+            self._fragments[i] = (process(q.stem), [process(opt.text) for opt in q.options])
+    
+    def render_paper(self, student, items):
+        """拼装一份试卷的HTML"""
+        questions = self.converter.questions
+        parts = []
+        for num, (i, order) in enumerate(items, 1):
+            stem_html, option_htmls = self._fragments[i]
+            options = ''.join(
+                f'<li><span class="opt-label">{chr(ord("A") + k)}.</span> {option_htmls[orig]}</li>'
+                for k, orig in enumerate(order))
+            parts.append(
+                f'<div class="q"><div class="q-head">{num}. <span class="q-type">[{questions[i].type}]</span></div>'
+                f'<div class="q-stem">{stem_html}</div><ol class="q-options">{options}</ol></div>\n')
+        return self.converter.engine.template(EXAM_TEMPLATE).render(
+            title=self.converter._escape_html(self.title), student=self.converter._escape_html(student),
+            count=len(items), questions=''.join(parts))
+    
+    def write(self, out_dir, students):
+        """为每个学生写出试卷，所有答案写入一个CSV，返回 (试卷路径列表, 答案文件路径)"""
+        import csv
+        from concurrent.futures import ThreadPoolExecutor
+        
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        variants = [(student, self.variant(student)) for student in students]
+        self._render_fragments({i for _, items in variants for i, _ in items})
+        
+        # 学生编号只用于文件名时先清理，清理后重名的依次加序号，不会互相覆盖
+        paths = []
+        used = set()
+        for student, _ in variants:
+            stem = f'试卷_{_safe_filename(student)}'
+            name, n = stem, 1
+            while name.lower() in used:
+                n += 1
+                name = f'{stem}_{n}'
+            used.add(name.lower())
+            paths.append(out_dir / f'{name}.html')
+        
+        def write_paper(job):
+            path, (student, items) = job
+            path.write_text(self.render_paper(student, items), encoding='utf-8')
+            return path
+        
+        with ThreadPoolExecutor(max_workers=self.workers or 4) as executor:
+            papers = list(executor.map(write_paper, zip(paths, variants)))
+        
+        questions = self.converter.questions
+        key_file = out_dir / '答案.csv'
+        with open(key_file, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['学生', '题号', '答案', '题型', '题库题号'])
+            for student, items in variants:
+                for num, (i, order) in enumerate(items, 1):
+                    writer.writerow([student, num, self.answer_of(questions[i], order), questions[i].type, i + 1])
+        return papers, key_file
+
+
+class ItemAnalysis:
+    """题目分析：汇总多名学生导出的答题记录（页面「📤 导出」按钮生成的JSON）
+    
+    计算每题的难度（正确率）、区分度（高分组与低分组正确率之差）、各选项的选择人数和各题型的正确率。
+    学生按chunk_size人一批读入，每批组成「学生×题目」矩阵用NumPy按列汇总，内存只与每批大小和题数有关；
+    区分度需要先得到每个学生的成绩，因此第二遍只重新读取高分组和低分组的记录。
+    未安装NumPy时逐条累加，结果相同。
+    """
+    
+    # 高分组和低分组各占的比例（常用的27%分组法）
+    GROUP_RATIO = 0.27
+    
+    def __init__(self, converter, chunk_size=256):
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        self._np = numpy
+        self.converter = converter
+        self.chunk_size = max(1, chunk_size)
+        self._index = {qid: i for i, qid in enumerate(converter.question_ids())}
+        # 选项计数按 题目序号 × width + 选项序号 展平存放
+        self.width = max((len(q.options) for q in converter.questions), default=0) or 1
+        self.students = 0
+        self.unknown = 0  # 记录中题库里已不存在的题目（题目被修改或删除）
+        self.answered = self.correct = self.choices = None
+        self.upper = self.lower = None  # 高分组/低分组的 (作答数, 正确数)
+    
+    def _load(self, path):
+        """读取一名学生的记录：(题目序号列表, 是否正确列表, 展平的选项序号列表)"""
+        import json
+        
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get('format') != 'qbank-results':
+            raise ValueError(f"不是答题记录文件：{path}")
+        
+        lookup, width = self._index.get, self.width
+        cols, correct, picks = [], [], []
+        for qid, result in data.get('results', {}).items():
+            i = lookup(qid)
+            if i is None:
+                self.unknown += 1
+                continue
+            cols.append(i)
+            correct.append(1 if result.get('correct') else 0)
+            base = i * width
+            for k in result.get('choice', ()):
+                if 0 <= k < width:
+                    picks.append(base + k)
+        return cols, correct, picks
+    
+    def _scan(self, paths):
+        """读取一组学生的记录，返回 (各题作答数, 各题正确数, 各选项选择数, 各学生正确率)"""
+        n = len(self._index)
+        np = self._np
+        if np is None:
+            answered, correct, choices, rates = [0] * n, [0] * n, [0] * (n * self.width), []
+        else:
+            answered = np.zeros(n, dtype=np.int64)
+            correct = np.zeros(n, dtype=np.int64)
+            choices = np.zeros(n * self.width, dtype=np.int64)
+            rates = []
+        
+        for start in range(0, len(paths), self.chunk_size):
+            records = [self._load(path) for path in paths[start:start + self.chunk_size]]
+            if np is None:
+                for cols, right, picks in records:
+                    for i, ok in zip(cols, right):
+                        answered[i] += 1
+                        correct[i] += ok
+                    for k in picks:
+                        choices[k] += 1
+                    rates.append(sum(right) / len(right) if right else 0.0)
+                continue
+            
+            # 本批学生的「学生×题目」矩阵：-1 未作答，0 答错，1 答对
+            scores = np.full((len(records), n), -1, dtype=np.int8)
+            for row, (cols, right, _) in enumerate(records):
+                scores[row, cols] = right
+            done = scores >= 0
+            right = scores == 1
+            answered += done.sum(axis=0)
+            correct += right.sum(axis=0)
+            picks = [np.asarray(p, dtype=np.int64) for _, _, p in records]
+            if picks:
+                choices += np.bincount(np.concatenate(picks), minlength=choices.size)
+            rates.extend((right.sum(axis=1) / np.maximum(done.sum(axis=1), 1)).tolist())
+        return answered, correct, choices, rates
+    
+    def run(self, paths):
+        """分析一组答题记录文件"""
+        paths = list(paths)
+        if not paths:
+            raise ValueError("没有答题记录文件")
+        self.unknown = 0
+        self.answered, self.correct, self.choices, rates = self._scan(paths)
+        self.students = len(paths)
+        unknown = self.unknown
+        
+        # 按正确率排序分组，第二遍只读高分组和低分组
+        group = max(1, round(len(paths) * self.GROUP_RATIO))
+        ranked = sorted(range(len(paths)), key=rates.__getitem__)
+        self.lower = self._scan([paths[i] for i in ranked[:group]])[:2]
+        self.upper = self._scan([paths[i] for i in ranked[-group:]])[:2]
+        self.unknown = unknown
+        return self
+    
+    def difficulty(self, i):
+        """第i题的正确率（无人作答时为None）"""
+        answered = int(self.answered[i])
+        return int(self.correct[i]) / answered if answered else None
+    
+    def discrimination(self, i):
+        """第i题的区分度 D = 高分组正确率 - 低分组正确率（任一组无人作答时为None）"""
+        (upper_done, upper_right), (lower_done, lower_right) = self.upper, self.lower
+        if not upper_done[i] or not lower_done[i]:
+            return None
+        return int(upper_right[i]) / int(upper_done[i]) - int(lower_right[i]) / int(lower_done[i])
+    
+    def option_counts(self, i):
+        """第i题各选项被选择的次数"""
+        base = i * self.width
+        return [int(c) for c in self.choices[base:base + len(self.converter.questions[i].options)]]
+    
+    def by_type(self):
+        """各题型的 (作答次数, 正确次数)"""
+        totals = {}
+        for i, q in enumerate(self.converter.questions):
+            done, right = totals.get(q.type, (0, 0))
+            totals[q.type] = (done + int(self.answered[i]), right + int(self.correct[i]))
+        return totals
+    
+    def write_report(self, path):
+        """写出CSV报告：每题一行"""
+        import csv
+        
+        questions = self.converter.questions
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['题库题号', '题型', '题干', '作答人数', '正确率', '区分度', '正确答案']
+                            + [f'选项{chr(ord("A") + k)}' for k in range(self.width)])
+            for i, q in enumerate(questions):
+                p, d = self.difficulty(i), self.discrimination(i)
+                answer = ''.join(chr(ord('A') + k) for k, opt in enumerate(q.options) if opt.is_correct)
+                stem = q.stem.strip().splitlines()[0][:60] if q.stem.strip() else ''
+                writer.writerow([i + 1, q.type, stem, int(self.answered[i]),
+                                 '' if p is None else f'{p:.3f}', '' if d is None else f'{d:.3f}', answer]
+                                + self.option_counts(i))
+        return path
+    
+    def badges(self):
+        """题目ID -> 难度标注的HTML，供重新生成带标注的题库页面"""
+        badges = {}
+        for i, qid in enumerate(self.converter.question_ids()):
+            p = self.difficulty(i)
+            if p is None:
+                continue
+            d = self.discrimination(i)
+            text = f'正确率 {p:.0%}' + ('' if d is None else f' · 区分度 {d:.2f}')
+            badges[qid] = f'<span class="q-badge" title="{int(self.answered[i])}人作答">{text}</span>'
+        return badges
+
+
+class RemoteImageCache:
+    """远程图片下载器
+    
+    按主机复用HTTP(S)长连接，并发连接总数不超过max_connections；
+    下载结果保存在磁盘缓存中，再次构建时带If-None-Match/If-Modified-Since重新验证，
+    服务器不可达时使用缓存，没有缓存则返回None（调用方保留原链接）。
+    """
+    
+    USER_AGENT = 'md_qbank_to_html'
+    MAX_REDIRECTS = 5
+    
+    def __init__(self, cache_dir=None, max_connections=8, timeout=10):
+        import threading
+        
+        self.cache_dir = Path(cache_dir) if cache_dir else Path.home() / '.cache' / 'md_qbank_to_html' / 'images'
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = {}  # (scheme, host) -> 空闲连接列表
+        self.stats = {'downloaded': 0, 'revalidated': 0, 'stale': 0, 'failed': 0}
+    
+    def data_uri(self, url):
+        """取得远程图片的data URI，失败且无缓存时返回None"""
+        result = self.fetch(url)
+        if result is None:
+            return None
+        data, mime_type = result
+        return f'data:{mime_type};base64,{base64.b64encode(data).decode("ascii")}'
+    
+    def fetch(self, url):
+        """下载（或从缓存验证）图片，返回 (字节, MIME类型) 或 None"""
+        import hashlib
+        import http.client
+        import json
+        import tempfile
+        
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        body_path = self.cache_dir / key
+        meta_path = self.cache_dir / f'{key}.json'
+        try:
+            meta = json.loads(meta_path.read_text(encoding='utf-8')) if body_path.exists() else None
+        except (OSError, ValueError):
+            meta = None
+        
+        headers = {'User-Agent': self.USER_AGENT}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        
+        try:
+            status, response_headers, body = self._request(url, headers)
+        except (OSError, http.client.HTTPException):
+            status, response_headers, body = None, {}, b''
+        
+        if status == 304 and meta:
+            self._count('revalidated')
+            return body_path.read_bytes(), meta['content_type']
+        
+        content_type = (response_headers.get('Content-Type') or '').split(';')[0].strip()
+        if status == 200 and not content_type.startswith(('text/', 'application/json')):
+            if not content_type.startswith('image/'):
+                content_type = mimetypes.guess_type(url.split('?')[0])[0] or 'image/jpeg'
+            # 先写临时文件再替换，并发构建不会读到写了一半的缓存
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, body_path)
+            meta_path.write_text(json.dumps({
+                'url': url,
+                'etag': response_headers.get('ETag'),
+                'last_modified': response_headers.get('Last-Modified'),
+                'content_type': content_type,
+            }), encoding='utf-8')
+            self._count('downloaded')
+            return body, content_type
+        
+        # 服务器不可达或出错：有缓存时使用缓存
+        if meta:
+            self._count('stale')
+            return body_path.read_bytes(), meta['content_type']
+        self._count('failed')
+        return None
+    
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+    
+    def _request(self, url, headers):
+        """发送GET请求（跟随重定向），返回 (状态码, 响应头, 响应体)"""
+        from urllib.parse import urljoin, urlsplit
+        
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+            status, response_headers, body = self._send(parts.scheme, parts.netloc, path, headers)
+            location = response_headers.get('Location')
+            if status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            return status, response_headers, body
+        return None, {}, b''
+    
+    def _send(self, scheme, host, path, headers):
+        """在连接池中取一个连接发送请求；复用的连接已被服务器关闭时换新连接重试一次"""
+        import http.client
+        
+        key = (scheme, host)
+        with self._slots:
+            for attempt in range(2):
+                with self._lock:
+                    idle = self._idle.get(key)
+                    conn = idle.pop() if idle else None
+                reused = conn is not None
+                if conn is None:
+                    cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+                    conn = cls(host, timeout=self.timeout)
+                try:
+                    conn.request('GET', path, headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                
+                if response.will_close:
+                    conn.close()
+                else:
+                    with self._lock:
+                        self._idle.setdefault(key, []).append(conn)
+                return response.status, response.headers, body
+    
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class BuildManifest:
+    """构建清单：输出文件旁的 <输出文件>.manifest.json，用于跳过未变化的题库（类似make）
+    
+    记录源文件和所有嵌入图片的大小、修改时间和内容哈希，模板版本（模板和转换程序的哈希）及影响输出的选项。
+    检查时先比较大小和修改时间，不一致时才计算哈希：只是被touch过的文件不触发重建，只更新清单。
+    远程图片只记录内容哈希，检查时不联网，不参与判断。
+    """
+    
+    VERSION = 1
+    SUFFIX = '.manifest.json'
+    # 影响输出内容的转换选项（并发数、缓存目录等不影响输出）
+    OPTIONS = ('minify', 'shard', 'shard_site', 'dedup', 'fetch_images', 'lazy_images', 'pwa')
+    
+    _generator_hash = None
+    
+    def __init__(self, html_file):
+        self.html_file = Path(html_file)
+        self.path = self.html_file.with_name(self.html_file.name + self.SUFFIX)
+    
+    @classmethod
+    def template_version(cls, template=None):
+        """模板版本：转换程序（含内置模板）和所用页面模板的哈希"""
+        import hashlib
+        
+        if cls._generator_hash is None:
+            cls._generator_hash = hashlib.sha256(Path(__file__).read_bytes())
+        digest = cls._generator_hash.copy()
+        digest.update((template or HTML_TEMPLATE).encode('utf-8'))
+        return digest.hexdigest()[:16]
+    
+    @classmethod
+    def output_options(cls, options):
+        """只保留影响输出的选项"""
+        return {key: options.get(key) for key in cls.OPTIONS}
+    
+    @staticmethod
+    def file_entry(path):
+        """文件的大小、修改时间和内容哈希"""
+        st = os.stat(path)
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': QBankStore._file_hash(path)}
+    
+    @staticmethod
+    def _compare(path, entry):
+        """先比较大小和修改时间，再比较哈希：返回 'same' / 'touched' / 'changed' / 'missing'"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 'missing'
+        if st.st_size == entry.get('size') and st.st_mtime_ns == entry.get('mtime_ns'):
+            return 'same'
+        if st.st_size == entry.get('size') and QBankStore._file_hash(path) == entry.get('sha256'):
+            entry['mtime_ns'] = st.st_mtime_ns
+            return 'touched'
+        return 'changed'
+    
+    def load(self):
+        """读取清单，不存在或无法解析时返回None"""
+        import json
+        
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        return data if isinstance(data, dict) and data.get('version') == self.VERSION else None
+    
+    def _save(self, data):
+        import json
+        
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding='utf-8')
+        os.replace(tmp, self.path)
+    
+    def record(self, converter, options, source=None):
+        """转换成功后写出清单；source 为转换前取得的源文件信息（避免转换期间源文件被修改）"""
+        st = self.html_file.stat()
+        self._save({
+            'version': self.VERSION,
+            'template': self.template_version(converter.template),
+            'options': self.output_options(options),
+            'source': dict(source or self.file_entry(converter.md_file), path=str(converter.md_file.resolve())),
+            'images': dict(sorted(converter.image_dependencies.items())),
+            'output': {'size': st.st_size, 'mtime_ns': st.st_mtime_ns},
+        })
+    
+    def check(self, md_file, options, template=None, update=True):
+        """返回需要重建的原因列表，为空表示输出已是最新；update 为False时不改写清单"""
+        if not self.html_file.exists():
+            return ["输出文件不存在"]
+        data = self.load()
+        if data is None:
+            return ["没有构建清单"]
+        
+        reasons = []
+        st = self.html_file.stat()
+        if (st.st_size, st.st_mtime_ns) != (data['output']['size'], data['output']['mtime_ns']):
+            reasons.append("输出文件已被改动")
+        if options.get('shard_site') and not self.html_file.with_name(self.html_file.stem + '_chunks').is_dir():
+            reasons.append("分块目录不存在")
+        if options.get('pwa') and not all(path.exists() for path in MarkdownQBankConverter._pwa_files(self.html_file)):
+            reasons.append("PWA文件不存在")
+        if data['template'] != self.template_version(template):
+            reasons.append("模板或转换程序已更新")
+        changed = [key for key, value in self.output_options(options).items() if data['options'].get(key) != value]
+        if changed:
+            reasons.append(f"选项已变化：{', '.join(changed)}")
+        
+        source = data['source']
+        touched = False
+        if source['path'] != str(Path(md_file).resolve()):
+            reasons.append("源文件不同")
+        else:
+            state = self._compare(md_file, source)
+            touched = state == 'touched'
+            if state in ('changed', 'missing'):
+                reasons.append("源文件已修改" if state == 'changed' else "源文件不存在")
+        
+        for key, entry in data['images'].items():
+            if key.startswith(('http://', 'https://')):
+                continue
+            if entry['sha256'] is None:
+                if os.path.exists(key):
+                    reasons.append(f"新增图片：{key}")
+                continue
+            state = self._compare(key, entry)
+            touched = touched or state == 'touched'
+            if state in ('changed', 'missing'):
+                reasons.append(f"图片已{'修改' if state == 'changed' else '删除'}：{key}")
+        
+        # 内容未变、只是修改时间变了：更新清单，下次只需比较文件信息
+        if touched and update and not reasons:
+            self._save(data)
+        return reasons
+
+
+class QBankIndex:
+    """源文件索引：题库旁的 <题库文件>.qindex.json，记录每个题型段落和每道题的字节范围和行范围
+    
+    索引以源文件的大小、修改时间和内容哈希校验（与构建清单相同），有效时读取单题或单个段落
+    只需一次seek和一次读取，不必解析整个题库；适合预览、检索结果展示和报错时定位原文。
+    题目记录为 [题号, 段落序号, 起始字节, 结束字节, 首行, 末行]，行号从1开始，题目前没有段落时段落序号为None。
+    """
+    
+    VERSION = 1
+    SUFFIX = '.qindex.json'
+    
+    def __init__(self, md_file):
+        self.md_file = Path(md_file)
+        self.path = self.md_file.with_name(self.md_file.name + self.SUFFIX)
+        self.data = None
+    
+    @classmethod
+    def open(cls, md_file, workers=None):
+        """读取有效的索引，不存在或已过期时解析题库重建"""
+        index = cls(md_file)
+        if index.load() is None:
+            index.build(workers)
+        return index
+    
+    def load(self):
+        """读取并校验索引，无效时返回None；源文件只是被touch过时更新索引中的文件信息"""
+        import json
+        
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return None
+        state = BuildManifest._compare(self.md_file, data['source'])
+        if state not in ('same', 'touched'):
+            return None
+        if state == 'touched':
+            self._save(data)
+        self.data = data
+        return data
+    
+    def build(self, workers=None):
+        """解析题库并写出索引"""
+        converter = MarkdownQBankConverter(self.md_file, workers=workers, index=True)
+        if converter.source_index is None:
+            raise ValueError(f"解析期间源文件被修改：{self.md_file}")
+        self.data = converter.source_index
+        return self.data
+    
+    def _save(self, data):
+        import json
+        
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(',', ':')), encoding='utf-8')
+        os.replace(tmp, self.path)
+    
+    def record(self, converter, st):
+        """由带 index=True 解析的转换器写出索引；st 为解析前的源文件信息，文件在解析期间变化时不写出并返回None"""
+        import hashlib
+        from itertools import accumulate
+        
+        data = self.md_file.read_bytes()
+        after = self.md_file.stat()
+        if (st.st_size, st.st_mtime_ns) != (after.st_size, after.st_mtime_ns) or len(data) != st.st_size:
+            return None
+        # 各行的起始字节；bytes.splitlines 与文本模式的换行处理一致（\n、\r\n、\r）
+        offsets = list(accumulate(map(len, data.splitlines(True)), initial=0))
+        
+        def pos(line):
+            return offsets[min(line, len(offsets) - 1)]
+        
+        sections = []
+        questions = []
+        for kind, *span in converter._spans:
+            if kind == 'section':
+                if sections:
+                    sections[-1]['end'] = span[1]
+                sections.append({'type': span[0], 'start': span[1], 'questions': [len(questions)] * 2})
+                continue
+            start, end = span
+            section = len(sections) - 1 if sections else None
+            questions.append([converter.questions[len(questions)].id, section, pos(start), pos(end), start + 1, end])
+            if sections:
+                sections[-1]['questions'][1] = len(questions)
+        for section in sections:
+            start, end = section.pop('start'), section.pop('end', len(offsets) - 1)
+            # 有题目的段落到最后一题为止，不含其后的空行
+            first, last = section['questions']
+            if last > first:
+                end = questions[last - 1][5]
+            section['bytes'] = [pos(start), pos(end)]
+            section['lines'] = [start + 1, end]
+        
+        index = {
+            'version': self.VERSION,
+            'source': {'path': str(self.md_file.resolve()), 'size': len(data), 'mtime_ns': after.st_mtime_ns,
+                       'sha256': hashlib.sha256(data).hexdigest()},
+            'title': converter.title,
+            'description': converter.description,
+            'sections': sections,
+            'questions': questions,
+        }
+        self._save(index)
+        self.data = index
+        return index
+    
+    def __len__(self):
+        return len(self.data['questions'])
+    
+    @property
+    def sections(self):
+        """[(题型, 题数)]"""
+        return [(section['type'], section['questions'][1] - section['questions'][0])
+                for section in self.data['sections']]
+    
+    def find(self, qid, section=None):
+        """题号（Markdown中的编号）对应的题目序号列表；不同题型段落的题号可能重复，可用 section 限定"""
+        return [n for n, entry in enumerate(self.data['questions'])
+                if entry[0] == str(qid) and (section is None or entry[1] == section)]
+    
+    def location(self, n):
+        """第n题（从0开始）在源文件中的 (首行, 末行)"""
+        entry = self.data['questions'][n]
+        return entry[4], entry[5]
+    
+    def _read(self, start, end):
+        """读取字节范围，换行处理与解析时一致"""
+        with open(self.md_file, 'rb') as f:
+            f.seek(start)
+            text = f.read(end - start).decode('utf-8')
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+    
+    def source(self, n):
+        """第n题的原文"""
+        entry = self.data['questions'][n]
+        return self._read(entry[2], entry[3])
+    
+    def _parser(self):
+        converter = MarkdownQBankConverter.__new__(MarkdownQBankConverter)
+        converter._init_state(self.md_file)
+        return converter
+    
+    def question(self, n):
+        """只读取并解析第n题"""
+        qid, section = self.data['questions'][n][:2]
+        qtype = self.data['sections'][section]['type'] if section is not None else ""
+        question, _ = self._parser()._parse_question(self.source(n).split('\n'), 0, sys.intern(qtype))
+        if question is None or question.id != qid:
+            raise ValueError(f"索引已过期，请重建：{self.path}")
+        return question
+    
+    def section(self, k):
+        """只读取并解析第k个题型段落，返回其中的题目"""
+        section = self.data['sections'][k]
+        parser = self._parser()
+        parser._parse_lines(self._read(*section['bytes']).split('\n'))
+        first, last = section['questions']
+        if [q.id for q in parser.questions] != [entry[0] for entry in self.data['questions'][first:last]]:
+            raise ValueError(f"索引已过期，请重建：{self.path}")
+        return parser.questions
+
+
+# 题目HTML片段（str.format模板）
+QUESTION_FRAGMENTS = {
+    'head': '''
+<div class="question" data-qid="{qid}" data-type="{qtype}" data-answered="false" data-correct="false" data-auto-wrong="false" data-mark-important="false">
     <div class="mark-btns">
         <button class="mark-btn mark-important" onclick="toggleMark(this, 'important')" title="标记为重点">📌</button>
     </div>
     <div class="q-header">
         <span class="q-num">第 {display_num} 题</span>
-        <span class="q-type">[{qtype}]</span>
+        <span class="q-type">[{qtype}]</span>{badge_html}
         <span class="q-status"></span>
     </div>
     <div class="q-stem">{stem_html}</div>
     <div class="q-options">
-'''
-        
-        # 生成选项
-        for idx, opt in enumerate(q['options']):
-            option_html = self._process_markdown(opt['text'])
-            explanation_html = self._process_markdown(opt['explanation']) if opt['explanation'] else ""
-            
-            input_type = 'checkbox' if is_multiple else 'radio'
-            correct_class = 'correct-option' if opt['is_correct'] else ''
-            
-            # 根据是否正确答案，添加不同的解析标签
-            if explanation_html:
-                if opt['is_correct']:
-                    explanation_content = f'<div class="explanation correct-exp"><span class="exp-icon">✅ 正确</span> {explanation_html}</div>'
-                else:
-                    explanation_content = f'<div class="explanation wrong-exp"><span class="exp-icon">❌ 错误</span> {explanation_html}</div>'
-            else:
-                explanation_content = ''
-            
-            html += f'''
-        <div class="option {correct_class}" data-correct="{str(opt['is_correct']).lower()}" onclick="{'' if is_multiple else 'selectSingleOption(this)'}">
+''',
+    'option': '''
+        <div class="option {correct_class}" data-correct="{is_correct}" onclick="{option_click}">
             <label>
-                <input type="{input_type}" name="q{q['id']}" value="{idx}" {'' if is_multiple else 'onclick="event.stopPropagation()"'}>
-                <span class="option-label">{idx + 1}.</span>
-                <span class="option-text">{option_html}</span>
+                <input type="{input_type}" name="q{qid}" value="{idx}" {input_click}>
+                <span class="option-label">{label}.</span>
+                <span class="option-text"{option_attrs}>{option_html}</span>
             </label>
             {explanation_content}
         </div>
-'''
-        
-        # 多选题需要提交按钮
-        if need_submit:
-            html += '''
+''',
+    'tail_submit': '''
     </div>
     <div class="q-actions">
         <button class="btn-check" onclick="checkAnswer(this)">查看答案</button>
@@ -405,25 +2639,248 @@ class MarkdownQBankConverter:
     </div>
     <div class="q-result" style="display:none;"></div>
 </div>
-'''
-        else:
-            html += '''
+''',
+    'tail': '''
     </div>
     <div class="q-actions" style="display:none;">
         <button class="btn-reset" onclick="resetQuestion(this)">重置</button>
     </div>
 </div>
-'''
+''',
+}
+
+
+def _compact_markup(fragment):
+    """去掉HTML片段中标签之间的换行和缩进（在填入内容之前调用，不影响代码块和公式）"""
+    return re.sub(r'\n\s*', '', fragment)
+
+
+_MINIFIED_QUESTION_FRAGMENTS = {key: _compact_markup(value) for key, value in QUESTION_FRAGMENTS.items()}
+
+
+def _minified_template(template):
+    """压缩页面模板中的静态HTML/CSS/JS（结果随预编译模板缓存在引擎中，同一模板只压缩一次）
+    
+    CSS去掉注释并合并空白；JS逐行去掉缩进、空行和整行注释，保留换行以免影响自动分号插入；
+    HTML去掉缩进、空行和整行注释。模板中的占位符和双写花括号保持不变。
+    """
+    def minify_css(css):
+        css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+        css = re.sub(r'\s+', ' ', css)
+        css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+        css = re.sub(r':\s+', ':', css)
+        css = css.replace(';}', '}')
+        return css.strip()
+    
+    def minify_js(js):
+        lines = (line.strip() for line in js.split('\n'))
+        return '\n'.join(line for line in lines if line and not line.startswith('//'))
+    
+    def minify_html(html):
+        html = re.sub(r'^\s*<!--.*?-->\s*$', '', html, flags=re.MULTILINE)
+        out = ''
+        for line in html.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            # 只有文字与文字相邻时才需要保留一个空格
+            if out and not out.endswith('>') and not line.startswith('<'):
+                out += ' '
+            out += line
+        return out
+    
+    parts = []
+    pos = 0
+    for m in re.finditer(r'(<style>)(.*?)(</style>)|(<script>)(.*?)(</script>)', template, re.DOTALL):
+        parts.append(minify_html(template[pos:m.start()]))
+        if m.group(1):
+            parts.append(m.group(1) + minify_css(m.group(2)) + m.group(3))
+        else:
+            parts.append(m.group(4) + minify_js(m.group(5)) + m.group(6))
+        pos = m.end()
+    parts.append(minify_html(template[pos:]))
+    return ''.join(parts)
+
+
+class CompiledTemplate:
+    """预编译的页面模板
+    
+    模板源码（str.format语法，花括号双写）只解析一次：静态部分预先编码为bytes，
+    占位符变为命名槽位。渲染时依次产出静态片段的memoryview和槽位内容；
+    槽位值可以是字符串、数字、bytes，或产生str/bytes的可迭代对象（如生成器），
+    可迭代的槽位值边产出边写出，不必先拼成整页字符串。
+    """
+    
+    def __init__(self, source):
+        import string
+        
+        segments = []
+        self.slots = []
+        literal = []
+        for text, field, spec, conversion in string.Formatter().parse(source):
+            literal.append(text)
+            if field is None:
+                continue
+            if spec or conversion or not field.isidentifier():
+                raise ValueError(f"不支持的模板占位符：{{{field}}}")
+            segments.append(''.join(literal).encode('utf-8'))
+            literal = []
+            self.slots.append(field)
+        segments.append(''.join(literal).encode('utf-8'))
+        
+        self.segments = [memoryview(segment) for segment in segments]
+        self.slot_names = frozenset(self.slots)
+    
+    def iter_bytes(self, **values):
+        """按顺序产出页面的bytes片段"""
+        encoded = {}
+        for name in self.slot_names:
+            value = values[name]
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                encoded[name] = value
+            elif isinstance(value, (str, int, float)):
+                encoded[name] = str(value).encode('utf-8')
+            elif self.slots.count(name) > 1:
+                raise ValueError(f"槽位 {name} 在模板中出现多次，不能使用可迭代对象")
+            else:
+                encoded[name] = value
         
-        return html
+        for segment, name in zip(self.segments, self.slots):
+            yield segment
+            value = encoded[name]
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                yield value
+            else:
+                for part in value:
+                    yield part.encode('utf-8') if isinstance(part, str) else part
+        yield self.segments[-1]
     
-    def get_stats(self):
-        """获取统计信息"""
-        return {
-            'title': self.title,
-            'total': self.stats['total'],
-            'by_type': self.stats['by_type']
-        }
+    def render(self, **values):
+        """渲染为完整字符串"""
+        return b''.join(self.iter_bytes(**values)).decode('utf-8')
+    
+    def write_to(self, f, **values):
+        """流式写入二进制文件对象"""
+        f.writelines(self.iter_bytes(**values))
+
+
+def compile_template(template, minify=False):
+    """取得预编译模板（缓存在默认引擎中），同一模板内容只编译一次"""
+    return _DEFAULT_ENGINE.template(template, minify)
+
+
+# Windows不允许的文件名字符（含控制字符）和保留设备名
+_UNSAFE_FILENAME_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+_RESERVED_FILENAMES = frozenset(['CON', 'PRN', 'AUX', 'NUL'] + [f'{dev}{n}' for dev in ('COM', 'LPT') for n in range(1, 10)])
+
+
+def _safe_filename(name):
+    """把任意文字（如学生编号）变成只在当前目录内的合法文件名：替换路径分隔符和非法字符，
+    去掉首尾的点和空格（避免 . 和 ..），避开Windows保留名"""
+    name = _UNSAFE_FILENAME_RE.sub('_', str(name)).strip(' .')
+    if not name:
+        return '_'
+    if name.split('.')[0].upper() in _RESERVED_FILENAMES:
+        name = '_' + name
+    return name[:120]
+
+
+def _json_for_script(data):
+    """序列化为可以安全放入<script>的JSON"""
+    import json
+    
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+
+
+def _image_size(data):
+    """从PNG/GIF/JPEG文件头读取图片尺寸 (宽, 高)，无法识别时返回None"""
+    import struct
+    
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+        return struct.unpack('>II', data[16:24])
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', data[6:10])
+    if data[:2] == b'\xff\xd8':
+        # 依次跳过JPEG段，直到帧头（SOF0..SOF15，除去DHT/JPG/DAC）
+        pos = 2
+        while pos + 9 <= len(data):
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                pos += 2
+                continue
+            length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+                return width, height
+            pos += 2 + length
+    return None
+
+
+# Markdown图片 ![alt](src)
+_IMAGE_RE = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+
+# 解析和Markdown渲染用到的正则：导入时编译一次，各引擎和线程共用（编译结果不可变，无需缓存淘汰）
+# 题目行/选项行 "N. 内容"，缩进的选项行
+_ITEM_RE = re.compile(r'^\d+\.\s+')
+_ITEM_PARTS_RE = re.compile(r'^(\d+)\.\s+(.+)')
+_INDENTED_ITEM_RE = re.compile(r'^\s+\d+\.\s+')
+# 代码块、块级公式 $$...$$、行内公式 $...$
+_CODE_BLOCK_RE = re.compile(r'```(\w*)\n(.*?)```', re.DOTALL)
+_BLOCK_MATH_RE = re.compile(r'\$\$\s*\n?(.*?)\n?\s*\$\$', re.DOTALL)
+_INLINE_MATH_RE = re.compile(r'\$([^$\n]+)\$')
+# 按顺序替换：粗体 **text** 或 __text__，斜体 *text* 或 _text_，行内代码 `code`
+_INLINE_MARKUP_RULES = (
+    (re.compile(r'\*\*(.+?)\*\*'), r'<strong>\1</strong>'),
+    (re.compile(r'__(.+?)__'), r'<strong>\1</strong>'),
+    (re.compile(r'\*(.+?)\*'), r'<em>\1</em>'),
+    (re.compile(r'_(.+?)_'), r'<em>\1</em>'),
+    (re.compile(r'`([^`]+)`'), r'<code>\1</code>'),
+)
+_EMPTY_PARAGRAPH_RE = re.compile(r'<p>\s*</p>')
+
+# 并行解析的安全分割点：换行后紧跟顶格的 # 标题行或顶格的 "N. " 题目行
+_SPLIT_POINT_RE = re.compile(rb'\n(?=#|\d+\.[ \t]+\S)')
+
+# 分块解析时块首题型未知的占位符，合并时替换为上一块结束时的题型
+_CHUNK_QTYPE = sys.intern('\x00')
+
+# 内嵌分块中会提前结束<script>的 </script（HTML解析不区分大小写）
+_CHUNK_SCRIPT_END_RE = re.compile(r'</(script)', re.IGNORECASE)
+
+
+def _parse_chunk(md_file, start, end, index=False):
+    """进程池任务：解析源文件中 [start, end) 字节范围的分块；index 为True时同时返回块内的行范围"""
+    import mmap
+    
+    with open(md_file, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8')
+    # 与文本模式读取一致的换行处理
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    
+    converter = MarkdownQBankConverter.__new__(MarkdownQBankConverter)
+    converter._init_state(md_file)
+    converter.title = None  # 用于判断本块是否出现一级标题
+    if index:
+        converter._spans = []
+    qtype, open_description = converter._parse_lines(lines, _CHUNK_QTYPE)
+    return {
+        'has_title': converter.title is not None,
+        'title': converter.title,
+        'description': converter.description,
+        'questions': converter.questions,
+        'by_type': converter.stats['by_type'],
+        'qtype': qtype,
+        'open_description': open_description,
+        'spans': converter._spans,
+        # 分块在换行之后切分，块内行数即换行数
+        'lines': len(lines) - 1,
+    }
 
 
 # HTML模板
@@ -560,6 +3017,12 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             font-size: 0.8rem;
         }}
         
+        .q-badge {{
+            color: #888;
+            font-size: 0.75rem;
+            white-space: nowrap;
+        }}
+        
         .q-stem {{
             font-size: 1.05rem;
             color: #2c3e50;
@@ -952,6 +3415,11 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             display: none;
         }}
         
+        /* 分块输出：尚未展开的题目占位 */
+        .question.q-stub {{
+            min-height: 120px;
+        }}
+        
         /* 沉浸式答题模式 */
         body.immersive-mode .header,
         body.immersive-mode .stats-panel,
@@ -1115,6 +3583,12 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             display: none !important;
         }}
         
+        /* 打乱顺序后，列表按题目的CSS order排列（DOM节点不移动） */
+        body.review-mode.shuffled #questions-container {{
+            display: flex;
+            flex-direction: column;
+        }}
+        
         body.review-mode .question .explanation {{
             display: block !important;
         }}
@@ -1284,6 +3758,11 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             display: block;
         }}
         
+        /* 按需解码的图片：解码前按原尺寸占位 */
+        img[data-img]:not([src]) {{
+            background: #f0f0f0;
+        }}
+        
         .img-error {{
             color: #dc3545;
             font-size: 0.9rem;
@@ -1363,6 +3842,17 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             }},
             options: {{
                 skipHtmlTags: ['script', 'noscript', 'style', 'textarea', 'pre']
+            }},
+            startup: {{
+                // 不在加载时排版整个文档，由页面按题目按需排版
+                typeset: false,
+                ready: function() {{
+                    MathJax.startup.defaultReady();
+                    MathJax.startup.promise.then(function() {{
+                        window.mathJaxReady = true;
+                        if (window.onMathJaxReady) window.onMathJaxReady();
+                    }});
+                }}
             }}
         }};
     </script>
@@ -1425,8 +3915,13 @@ HTML_TEMPLATE = """<!DOCTYPE html>
                 </div>
                 <div class="action-btns">
                     <button class="action-btn" onclick="shuffleQuestions()">🔀 随机</button>
+                    <button class="action-btn" onclick="restoreOrder()">↩ 原序</button>
                     <button class="action-btn" onclick="resetAll()">🔄 重置</button>
                     <button class="action-btn" onclick="toggleReviewMode()" id="review-mode-btn">📖 复习模式</button>
+                    <button class="action-btn" onclick="toggleSessionMode('srs')" id="srs-mode-btn">🧠 记忆复习</button>
+                    <button class="action-btn" onclick="toggleSessionMode('practice')" id="practice-mode-btn">🎲 加权练习</button>
+                    <button class="action-btn" onclick="configurePracticeWeights()" title="加权练习的权重">⚖️</button>
+                    <button class="action-btn" onclick="exportResults()" title="导出答题记录，供老师汇总分析">📤 导出</button>
                 </div>
             </div>
         </div>
@@ -1449,18 +3944,48 @@ HTML_TEMPLATE = """<!DOCTYPE html>
     <script>
         // 初始化
         let currentQuestionIndex = 0;
+        let activeOrdinal = -1;   // 卡片模式下正在显示的题目序号，切换时只改动离开和进入的两张卡片
         let touchStartX = 0;
         let touchStartY = 0;
         
+        // 题目按序号（原始顺序下标）访问，打乱和筛选只改变序号数组，不移动DOM节点
+        let allQuestions = [];
+        let questionOrder = [];   // 当前顺序：原始顺序或按种子打乱后的排列
+        let visibleOrder = [];    // 当前顺序中未被筛选隐藏的序号
+        const idIndex = new Map();   // 题目ID（内容哈希） -> 序号
+        
+        // 答题进度：题目ID -> 状态；保留同一浏览器中其他题库的记录
+        let progressStore = {{}};
+        let progressSaveSuspended = false;
+        
+        // 分块输出：分块配置和全文搜索索引（非分块页面为null）
+        let shardConfig = null;
+        let searchIndex = null;
+        const chunkState = {{}};    // 块号 -> 'loaded' | 等待加载完成的回调列表
+        
         document.addEventListener('DOMContentLoaded', function() {{
-            hljs.highlightAll();
+            initFragments();
+            allQuestions = Array.from(document.querySelectorAll('.question'));
+            allQuestions.forEach((q, i) => {{
+                q.qbankOrdinal = i;
+                idIndex.set(q.dataset.qid, i);
+            }});
+            questionOrder = allQuestions.map((q, i) => i);
+            hiddenFlags = new Uint8Array(allQuestions.length);
+            initShards();
+            loadShuffleSeed();
+            refreshVisibleOrder();
+            initLazyTypeset();
+            initImages();
             loadProgress();
+            initWorker();
             updateStats();
             initSwipeGesture();
             showQuestion(0); // 显示第一道题
             updateQuestionCounter();
             loadModePreference(); // 加载模式偏好
             loadDarkModePreference(); // 加载夜间模式偏好
+            initPWA();
         }});
         
         // 单选/判断题：点击选项直接显示答案
@@ -1490,9 +4015,10 @@ HTML_TEMPLATE = """<!DOCTYPE html>
                 }}
             }});
             
-            // 标记题目已答
+            // 标记题目已答，记录所选选项（供导出后做题目分析）
             question.dataset.answered = 'true';
             question.dataset.correct = isCorrect ? 'true' : 'false';
+            question.dataset.choice = Array.from(options).indexOf(optionElement);
             
             // 自动标记错题
             if (!isCorrect) {{
@@ -1508,8 +4034,11 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             const resetBtn = question.querySelector('.btn-reset');
             if (resetBtn) resetBtn.style.display = 'inline-block';
             
+            // 安排下次复习
+            srsRecord(question, isCorrect);
+            
             // 保存进度
-            saveProgress();
+            saveProgress(question);
             updateStats();
         }}
         
@@ -1555,9 +4084,10 @@ HTML_TEMPLATE = """<!DOCTYPE html>
                 }}
             }});
             
-            // 标记题目已答
+            // 标记题目已答，记录所选选项（供导出后做题目分析）
             question.dataset.answered = 'true';
             question.dataset.correct = isCorrect ? 'true' : 'false';
+            question.dataset.choice = userAnswers.join(',');
             
             // 自动标记错题
             if (!isCorrect) {{
@@ -1581,8 +4111,11 @@ HTML_TEMPLATE = """<!DOCTYPE html>
                 question.dataset.autoWrong = 'true';
             }}
             
+            // 安排下次复习
+            srsRecord(question, isCorrect);
+            
             // 保存进度
-            saveProgress();
+            saveProgress(question);
             updateStats();
         }}
         
@@ -1606,6 +4139,7 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             // 清除状态
             question.dataset.answered = 'false';
             question.dataset.correct = 'false';
+            delete question.dataset.choice;
             const statusSpan = question.querySelector('.q-status');
             statusSpan.textContent = '';
             statusSpan.className = 'q-status';
@@ -1616,7 +4150,7 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             if (checkBtn) checkBtn.style.display = 'inline-block';
             
             // 保存进度
-            saveProgress();
+            saveProgress(question);
             updateStats();
         }}
         
@@ -1629,7 +4163,7 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             btn.textContent = !isMarked ? '⭐' : '☆';
             btn.classList.toggle('marked');
             
-            saveProgress();
+            saveProgress(question);
         }}
         
         // 标记功能（多标签）
@@ -1641,88 +4175,315 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             question.dataset[dataKey] = !isMarked ? 'true' : 'false';
             btn.classList.toggle('marked');
             
-            saveProgress();
+            saveProgress(question);
         }}
         
-        // 搜索过滤
+        // 搜索过滤（在后台线程中匹配）
         function filterQuestions() {{
             const keyword = document.getElementById('search-input').value.toLowerCase();
-            const questions = document.querySelectorAll('.question');
             
-            questions.forEach(q => {{
-                const text = q.textContent.toLowerCase();
-                q.classList.toggle('hidden', !text.includes(keyword));
+            runQuery({{ keyword }}, () => {{
+                // 重新显示第一道题
+                showQuestion(0, 'right');
             }});
-            
-            // 重新显示第一道题
-            showQuestion(0, 'right');
         }}
         
         // 按题型过滤
         function filterByType(btn) {{
             const filter = btn.dataset.filter;
-            const questions = document.querySelectorAll('.question');
             const body = document.body;
             
             // 更新按钮状态
             document.querySelectorAll('.filter-btn').forEach(b => b.classList.remove('active'));
             btn.classList.add('active');
             
-            // 过滤题目
-            questions.forEach(q => {{
-                if (filter === 'all') {{
-                    q.classList.remove('hidden');
-                }} else if (filter === 'auto-wrong') {{
-                    // 筛选自动错题：已答且错误的
-                    const isAutoWrong = q.dataset.answered === 'true' && q.dataset.correct === 'false';
-                    q.classList.toggle('hidden', !isAutoWrong);
-                }} else if (filter === 'important') {{
-                    q.classList.toggle('hidden', q.dataset.markImportant !== 'true');
+            // 过滤题目（在后台线程中计算）
+            runQuery({{ filter }}, () => {{
+                // 错题和重点筛选时，自动进入列表模式（类似复习模式）
+                if (filter === 'auto-wrong' || filter === 'important') {{
+                    body.classList.add('review-mode');
+                    window.scrollTo({{ top: 0, behavior: 'smooth' }});
                 }} else {{
-                    q.classList.toggle('hidden', !q.dataset.type.includes(filter));
+                    // 其他筛选保持卡片模式
+                    body.classList.remove('review-mode');
+                    // 重新显示第一道题
+                    showQuestion(0, 'right');
+                }}
+            }});
+        }}
+        
+        // ========== 后台线程：搜索、筛选和统计 ==========
+        
+        // 在Worker中运行的代码（通过toString()生成Worker脚本，不能引用页面中的其他变量）：
+        // 持有每题的搜索文本、题型和状态标志，筛选结果以题目序号列表返回
+        function qbankWorkerMain(scope) {{
+            let texts = [];
+            let types = [];
+            let flags = null;    // 每题一个字节：1 已答，2 答对，4 重点
+            let hidden = null;   // 当前筛选隐藏的题目
+            let answered = 0;
+            let correct = 0;
+            
+            function count(flag, sign) {{
+                if (flag & 1) {{
+                    answered += sign;
+                    if (flag & 2) correct += sign;
+                }}
+            }}
+            
+            function matches(i, query) {{
+                if (query.keyword !== undefined) return texts[i].includes(query.keyword);
+                const filter = query.filter;
+                if (filter === 'all') return true;
+                // 自动错题：已答且错误的
+                if (filter === 'auto-wrong') return (flags[i] & 3) === 1;
+                if (filter === 'important') return (flags[i] & 4) !== 0;
+                return types[i].includes(filter);
+            }}
+            
+            scope.onmessage = function(e) {{
+                const msg = e.data;
+                if (msg.type === 'init') {{
+                    texts = msg.texts;
+                    types = msg.types;
+                    flags = msg.flags;
+                    // 回退重建时沿用主线程当前的隐藏状态，后续查询结果仍是相对变化
+                    hidden = msg.hidden ? new Uint8Array(msg.hidden) : new Uint8Array(flags.length);
+                    answered = correct = 0;
+                    for (let i = 0; i < flags.length; i++) count(flags[i], 1);
+                }} else if (msg.type === 'update') {{
+                    // 答题、重置和标记后只更新变化的题目，统计增量维护
+                    msg.ordinals.forEach((i, k) => {{
+                        count(flags[i], -1);
+                        flags[i] = msg.flags[k];
+                        count(flags[i], 1);
+                    }});
+                }} else if (msg.type === 'stats') {{
+                    scope.postMessage({{ type: 'stats', total: flags.length, answered, correct }});
+                }} else if (msg.type === 'query') {{
+                    // 只返回显示状态有变化的序号，主线程只需改动这些题目
+                    const show = [];
+                    const hide = [];
+                    for (let i = 0; i < flags.length; i++) {{
+                        const h = matches(i, msg) ? 0 : 1;
+                        if (h !== hidden[i]) {{
+                            hidden[i] = h;
+                            (h ? hide : show).push(i);
+                        }}
+                    }}
+                    scope.postMessage({{ type: 'query', seq: msg.seq, show, hide }});
+                }}
+            }};
+        }}
+        
+        let qbankWorker = null;
+        let hiddenFlags = null;            // 每题是否被筛选隐藏，与.hidden类同步
+        let querySeq = 0;
+        const pendingQueries = new Map();  // 查询序号 -> 尚未返回的查询和回调
+        let workerTimer = null;            // 等待Worker首次返回的计时器
+        const WORKER_TIMEOUT = 5000;
+        
+        function questionFlags(q) {{
+            return (q.dataset.answered === 'true' ? 1 : 0) |
+                   (q.dataset.correct === 'true' ? 2 : 0) |
+                   (q.dataset.markImportant === 'true' ? 4 : 0);
+        }}
+        
+        // 按题目当前状态生成初始化消息
+        function workerInitMessage() {{
+            const texts = allQuestions.map((q, i) => searchIndex ? searchIndex[i] : q.textContent.toLowerCase());
+            const types = allQuestions.map(q => q.dataset.type);
+            const flags = new Uint8Array(allQuestions.length);
+            allQuestions.forEach((q, i) => {{ flags[i] = questionFlags(q); }});
+            return {{ type: 'init', texts, types, flags, hidden: hiddenFlags }};
+        }}
+        
+        // 创建Worker（由内联Blob生成，file://下也能使用）；不支持时在主线程同步运行同一份代码
+        function initWorker() {{
+            let worker = null;
+            if (window.Worker && window.Blob && window.URL) {{
+                try {{
+                    const source = '(' + qbankWorkerMain.toString() + ')(self);';
+                    worker = new Worker(URL.createObjectURL(new Blob([source], {{ type: 'text/javascript' }})));
+                }} catch (e) {{
+                    worker = null;
+                }}
+            }}
+            if (!worker) {{
+                startLocalWorker();
+                return;
+            }}
+            qbankWorker = worker;
+            worker.onmessage = e => {{
+                if (worker !== qbankWorker) return;
+                clearTimeout(workerTimer);
+                workerTimer = null;
+                handleWorkerMessage(e.data);
+            }};
+            // 脚本被拦截（如CSP禁止blob:）或运行出错时异步报告，此时改在主线程运行
+            worker.onerror = e => {{
+                if (e && e.preventDefault) e.preventDefault();
+                fallbackToLocalWorker(worker);
+            }};
+            worker.postMessage(workerInitMessage());
+            // 迟迟没有首次返回（Worker未能启动）也同样回退
+            workerTimer = setTimeout(() => fallbackToLocalWorker(worker), WORKER_TIMEOUT);
+        }}
+        
+        function startLocalWorker() {{
+            qbankWorker = createLocalWorker();
+            qbankWorker.onmessage = e => handleWorkerMessage(e.data);
+            qbankWorker.postMessage(workerInitMessage());
+        }}
+        
+        // 放弃Worker：按当前状态重新初始化主线程回退，并重发尚未返回的查询和统计
+        function fallbackToLocalWorker(worker) {{
+            if (worker !== qbankWorker) return;
+            clearTimeout(workerTimer);
+            workerTimer = null;
+            worker.terminate();
+            startLocalWorker();
+            Array.from(pendingQueries.values()).forEach(({{ query }}) => qbankWorker.postMessage(query));
+            qbankWorker.postMessage({{ type: 'stats' }});
+        }}
+        
+        // 同步回退：直接在主线程运行Worker代码，消息立即处理
+        function createLocalWorker() {{
+            const scope = {{}};
+            const local = {{
+                onmessage: null,
+                postMessage(data) {{ scope.onmessage({{ data }}); }}
+            }};
+            scope.postMessage = data => local.onmessage({{ data }});
+            qbankWorkerMain(scope);
+            return local;
+        }}
+        
+        // 发起筛选查询；连续输入时只有最后一次查询执行回调
+        function runQuery(query, callback) {{
+            query.type = 'query';
+            query.seq = ++querySeq;
+            pendingQueries.set(query.seq, {{ query, callback }});
+            qbankWorker.postMessage(query);
+        }}
+        
+        function handleWorkerMessage(msg) {{
+            if (msg.type === 'stats') {{
+                renderStats(msg);
+            }} else if (msg.type === 'query') {{
+                // 每次结果都是相对上一次的变化，必须按顺序全部应用
+                msg.show.forEach(i => {{
+                    hiddenFlags[i] = 0;
+                    allQuestions[i].classList.remove('hidden');
+                }});
+                msg.hide.forEach(i => {{
+                    hiddenFlags[i] = 1;
+                    allQuestions[i].classList.add('hidden');
+                }});
+                const pending = pendingQueries.get(msg.seq);
+                pendingQueries.delete(msg.seq);
+                if (msg.seq === querySeq) {{
+                    refreshVisibleOrder();
+                    if (pending && pending.callback) pending.callback();
                 }}
-            }});
-            
-            // 错题和重点筛选时，自动进入列表模式（类似复习模式）
-            if (filter === 'auto-wrong' || filter === 'important') {{
-                body.classList.add('review-mode');
-                window.scrollTo({{ top: 0, behavior: 'smooth' }});
-            }} else {{
-                // 其他筛选保持卡片模式
-                body.classList.remove('review-mode');
-                // 重新显示第一道题
-                showQuestion(0, 'right');
             }}
         }}
         
-        // 随机打乱题目
-        function shuffleQuestions() {{
-            const container = document.getElementById('questions-container');
-            const questions = Array.from(container.querySelectorAll('.question'));
-            
+        // 把题目的状态标志同步到后台线程
+        function syncWorkerFlags(questions) {{
+            if (!qbankWorker) return;
+            qbankWorker.postMessage({{
+                type: 'update',
+                ordinals: questions.map(q => q.qbankOrdinal),
+                flags: questions.map(questionFlags)
+            }});
+        }}
+        
+        // 可复现的伪随机数（mulberry32），同一种子得到同一排列
+        function seededRandom(seed) {{
+            let a = seed >>> 0;
+            return function() {{
+                a = (a + 0x6D2B79F5) | 0;
+                let t = Math.imul(a ^ (a >>> 15), 1 | a);
+                t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+                return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+            }};
+        }}
+        
+        // 按种子生成题目序号的排列
+        function applyShuffleSeed(seed) {{
+            const random = seededRandom(seed);
+            questionOrder = allQuestions.map((q, i) => i);
             // Fisher-Yates 洗牌算法
-            for (let i = questions.length - 1; i > 0; i--) {{
-                const j = Math.floor(Math.random() * (i + 1));
-                [questions[i], questions[j]] = [questions[j], questions[i]];
+            for (let i = questionOrder.length - 1; i > 0; i--) {{
+                const j = Math.floor(random() * (i + 1));
+                [questionOrder[i], questionOrder[j]] = [questionOrder[j], questionOrder[i]];
             }}
-            
-            // 重新添加到容器
-            questions.forEach(q => container.appendChild(q));
+        }}
+        
+        // 打乱种子按页面路径分别保存：同一来源下的不同题库互不影响
+        const SHUFFLE_SEED_KEY = 'qbank_shuffle_seed:' + location.pathname;
+        
+        // 列表（复习）模式的显示顺序：打乱时给每题设置CSS order，恢复时清除
+        function applyListOrder(shuffled) {{
+            document.body.classList.toggle('shuffled', shuffled);
+            questionOrder.forEach((ordinal, k) => {{
+                allQuestions[ordinal].style.order = shuffled ? k : '';
+            }});
+        }}
+        
+        // 随机打乱题目（只打乱序号数组，DOM不动；保存种子以便下次恢复）
+        function shuffleQuestions() {{
+            const seed = Math.floor(Math.random() * 4294967296);
+            applyShuffleSeed(seed);
+            applyListOrder(true);
+            localStorage.setItem(SHUFFLE_SEED_KEY, seed);
+            refreshVisibleOrder();
             
             // 显示第一道题
             showQuestion(0, 'right');
         }}
         
+        // 恢复原始顺序
+        function restoreOrder() {{
+            questionOrder = allQuestions.map((q, i) => i);
+            applyListOrder(false);
+            localStorage.removeItem(SHUFFLE_SEED_KEY);
+            refreshVisibleOrder();
+            showQuestion(0, 'right');
+        }}
+        
+        // 加载上次的打乱种子，恢复题目顺序
+        function loadShuffleSeed() {{
+            const seed = localStorage.getItem(SHUFFLE_SEED_KEY);
+            if (seed === null) return;
+            applyShuffleSeed(Number(seed));
+            applyListOrder(true);
+        }}
+        
+        // 按当前顺序重新计算可见题目的序号（筛选或打乱后调用）
+        function refreshVisibleOrder() {{
+            // 抽题模式的题目顺序由抽题决定，筛选或打乱时结束本轮
+            if (sessionMode) stopSession();
+            visibleOrder = questionOrder.filter(i => !hiddenFlags[i]);
+        }}
+        
         // 重置所有
         function resetAll() {{
             if (!confirm('确定要重置所有答题记录吗？')) return;
             
             const questions = document.querySelectorAll('.question');
+            progressSaveSuspended = true;
             questions.forEach(q => {{
                 const resetBtn = q.querySelector('.btn-reset');
                 if (resetBtn && resetBtn.style.display !== 'none') {{
                     resetQuestion(resetBtn);
                 }}
+                if (q.classList.contains('q-stub')) {{
+                    // 未展开的分块题目只有状态数据
+                    q.dataset.answered = 'false';
+                    q.dataset.correct = 'false';
+                }}
                 q.dataset.markedWrong = 'false';
                 const markBtn = q.querySelector('.mark-wrong-btn');
                 if (markBtn) {{
@@ -1731,26 +4492,25 @@ HTML_TEMPLATE = """<!DOCTYPE html>
                 }}
             }});
             
-            localStorage.removeItem('qbank_progress');
+            // 只清除本题库的记录
+            progressSaveSuspended = false;
+            idIndex.forEach((i, qid) => {{ delete progressStore[qid]; }});
+            srsHeap = [];
+            if (sessionMode) {{
+                refreshVisibleOrder();
+                showQuestion(0, 'right');
+            }}
+            localStorage.setItem('qbank_progress', JSON.stringify(progressStore));
+            syncWorkerFlags(allQuestions);
             updateStats();
         }}
         
-        // 更新统计
+        // 更新统计（由后台线程计数，结果返回后显示）
         function updateStats() {{
-            const questions = document.querySelectorAll('.question');
-            let total = questions.length;
-            let answered = 0;
-            let correct = 0;
-            
-            questions.forEach(q => {{
-                if (q.dataset.answered === 'true') {{
-                    answered++;
-                    if (q.dataset.correct === 'true') {{
-                        correct++;
-                    }}
-                }}
-            }});
-            
+            qbankWorker.postMessage({{ type: 'stats' }});
+        }}
+        
+        function renderStats({{ total, answered, correct }}) {{
             const accuracy = answered > 0 ? Math.round(correct / answered * 100) : 0;
             
             document.getElementById('total-count').textContent = total;
@@ -1759,78 +4519,390 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             document.getElementById('accuracy-rate').textContent = accuracy + '%';
             
             // 更新进度条
-            updateProgressBar();
+            updateProgressBar(answered, total);
         }}
         
-        // 保存进度到localStorage
-        function saveProgress() {{
-            const questions = document.querySelectorAll('.question');
-            const progress = {{}};
+        // 保存进度到localStorage（传入题目时只更新这一题的记录）
+        function saveProgress(question) {{
+            const questions = question ? [question] : allQuestions;
             
             questions.forEach(q => {{
-                const qid = q.dataset.qid;
-                progress[qid] = {{
-                    answered: q.dataset.answered,
-                    correct: q.dataset.correct,
-                    markImportant: q.dataset.markImportant || 'false'
+                // 保留记录中的复习安排（srs）
+                const record = progressStore[q.dataset.qid] || (progressStore[q.dataset.qid] = {{}});
+                record.answered = q.dataset.answered;
+                record.correct = q.dataset.correct;
+                record.markImportant = q.dataset.markImportant || 'false';
+                if (q.dataset.choice !== undefined) {{
+                    record.choice = q.dataset.choice;
+                }} else {{
+                    delete record.choice;
+                }}
+            }});
+            
+            if (!progressSaveSuspended) {{
+                localStorage.setItem('qbank_progress', JSON.stringify(progressStore));
+                syncWorkerFlags(questions);
+                if (practiceTree) practiceUpdate(questions);
+            }}
+        }}
+        
+        // 导出答题记录（JSON），老师用 analyze 命令汇总多名学生的记录做题目分析
+        function exportResults() {{
+            const student = prompt('请输入姓名或学号（写入导出文件）', localStorage.getItem('qbank_student') || '');
+            if (student === null) return;
+            localStorage.setItem('qbank_student', student);
+            
+            const results = {{}};
+            allQuestions.forEach(q => {{
+                if (q.dataset.answered !== 'true') return;
+                results[q.dataset.qid] = {{
+                    correct: q.dataset.correct === 'true',
+                    choice: q.dataset.choice ? q.dataset.choice.split(',').map(Number) : []
                 }};
             }});
+            const data = {{
+                format: 'qbank-results',
+                version: 1,
+                title: document.title,
+                student,
+                exported: new Date().toISOString(),
+                total: allQuestions.length,
+                results
+            }};
             
-            localStorage.setItem('qbank_progress', JSON.stringify(progress));
+            const url = URL.createObjectURL(new Blob([JSON.stringify(data)], {{ type: 'application/json' }}));
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = (student || '答题记录') + '.json';
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+            setTimeout(() => URL.revokeObjectURL(url), 1000);
+        }}
+        
+        // 按题目ID取题目节点（O(1)）
+        function questionById(qid) {{
+            const i = idIndex.get(qid);
+            return i === undefined ? null : allQuestions[i];
         }}
         
-        // 加载进度
+        // 加载进度：只遍历已保存的记录，按ID直接定位题目
         function loadProgress() {{
             const saved = localStorage.getItem('qbank_progress');
             if (!saved) return;
             
-            const progress = JSON.parse(saved);
-            const questions = document.querySelectorAll('.question');
+            progressStore = JSON.parse(saved);
+            srsHeap = [];
+            Object.keys(progressStore).forEach(qid => {{
+                const q = questionById(qid);
+                if (!q) return;
+                const record = progressStore[qid];
+                if (record.srs) srsHeap.push([record.srs.due, q.qbankOrdinal]);
+                q.dataset.answered = record.answered;
+                q.dataset.correct = record.correct;
+                q.dataset.markImportant = record.markImportant || 'false';
+                if (record.choice !== undefined) q.dataset.choice = record.choice;
+                applyProgressView(q);
+            }});
+            heapify(srsHeap);
+        }}
+        
+        // 根据题目的状态数据恢复状态显示和重点标记
+        function applyProgressView(q) {{
+            // 恢复状态显示
+            const statusSpan = q.querySelector('.q-status');
+            if (statusSpan && q.dataset.answered === 'true') {{
+                const isCorrect = q.dataset.correct === 'true';
+                statusSpan.textContent = isCorrect ? '✓ 正确' : '✗ 错误';
+                statusSpan.className = 'q-status ' + (isCorrect ? 'answered-correct' : 'answered-wrong');
+            }}
             
-            questions.forEach(q => {{
-                const qid = q.dataset.qid;
-                if (progress[qid]) {{
-                    q.dataset.answered = progress[qid].answered;
-                    q.dataset.correct = progress[qid].correct;
-                    q.dataset.markImportant = progress[qid].markImportant || 'false';
-                    
-                    // 恢复状态显示
-                    if (q.dataset.answered === 'true') {{
-                        const statusSpan = q.querySelector('.q-status');
-                        const isCorrect = q.dataset.correct === 'true';
-                        statusSpan.textContent = isCorrect ? '✓ 正确' : '✗ 错误';
-                        statusSpan.className = 'q-status ' + (isCorrect ? 'answered-correct' : 'answered-wrong');
-                    }}
-                    
-                    // 恢复重点标记
-                    if (q.dataset.markImportant === 'true') {{
-                        const btn = q.querySelector('.mark-important');
-                        if (btn) btn.classList.add('marked');
-                    }}
+            // 恢复重点标记
+            if (q.dataset.markImportant === 'true') {{
+                const btn = q.querySelector('.mark-important');
+                if (btn) btn.classList.add('marked');
+            }}
+        }}
+        
+        // ========== 重复片段表 ==========
+        
+        let fragmentTable = null;
+        
+        function initFragments() {{
+            const table = document.getElementById('qbank-fragments');
+            if (!table) return;
+            fragmentTable = JSON.parse(table.textContent);
+            expandFragments(document);
+        }}
+        
+        // 把 data-frag 引用替换为片段表中的HTML
+        function expandFragments(root) {{
+            if (!fragmentTable) return;
+            root.querySelectorAll('[data-frag]').forEach(el => {{
+                el.innerHTML = fragmentTable[+el.dataset.frag];
+                el.removeAttribute('data-frag');
+            }});
+        }}
+        
+        // ========== 离线安装（PWA） ==========
+        
+        // 通过HTTP访问时注册Service Worker并关联Web应用清单（本地文件打开时浏览器不支持）
+        function initPWA() {{
+            const config = document.getElementById('qbank-pwa');
+            if (!config || !('serviceWorker' in navigator) || !location.protocol.startsWith('http')) return;
+            const pwa = JSON.parse(config.textContent);
+            const link = document.createElement('link');
+            link.rel = 'manifest';
+            link.href = pwa.manifest;
+            document.head.appendChild(link);
+            navigator.serviceWorker.register(pwa.sw, {{ scope: pwa.scope }}).catch(err => {{
+                console.warn('离线缓存注册失败', err);
+            }});
+        }}
+        
+        // ========== 分块按需展开 ==========
+        
+        function initShards() {{
+            const config = document.getElementById('qbank-shards');
+            if (!config) return;
+            shardConfig = JSON.parse(config.textContent);
+            searchIndex = JSON.parse(document.getElementById('qbank-search').textContent);
+            const versions = document.getElementById('qbank-chunk-versions');
+            if (versions) shardConfig.versions = JSON.parse(versions.textContent);
+        }}
+        
+        // 确保第k块已展开：已就绪返回true；需要异步加载（站点模式）时返回false，加载完成后调用onReady
+        function ensureChunk(k, onReady) {{
+            const state = chunkState[k];
+            if (state === 'loaded') return true;
+            
+            const inline = document.getElementById('qbank-chunk-' + k);
+            if (inline) {{
+                materializeChunk(k, inline.textContent.replace(/<\\\\\\/(script)/gi, '</$1'));
+                inline.remove();
+                return true;
+            }}
+            
+            if (!shardConfig || !shardConfig.base) return false;
+            if (state) {{
+                if (onReady) state.push(onReady);
+                return false;
+            }}
+            const waiters = chunkState[k] = onReady ? [onReady] : [];
+            fetch(shardConfig.base + k + '.html' + (shardConfig.versions ? '?v=' + shardConfig.versions[k] : ''))
+                .then(resp => {{
+                    if (!resp.ok) throw new Error(resp.status);
+                    return resp.text();
+                }})
+                .then(html => {{
+                    materializeChunk(k, html);
+                    waiters.forEach(cb => cb());
+                }})
+                .catch(err => {{
+                    delete chunkState[k];
+                    console.warn('分块加载失败', k, err);
+                }});
+            return false;
+        }}
+        
+        // 解析一块题目HTML，替换对应的占位节点（保留占位节点上的状态和类名）
+        function materializeChunk(k, html) {{
+            const box = document.createElement('div');
+            box.innerHTML = html;
+            expandFragments(box);
+            const start = shardConfig.starts[k];
+            Array.from(box.querySelectorAll('.question')).forEach((node, j) => {{
+                const ordinal = start + j;
+                const stub = allQuestions[ordinal];
+                node.className = stub.className.replace('q-stub', '').trim();
+                ['answered', 'correct', 'autoWrong', 'markImportant', 'choice'].forEach(key => {{
+                    if (stub.dataset[key] !== undefined) node.dataset[key] = stub.dataset[key];
+                }});
+                node.qbankOrdinal = ordinal;
+                node.style.order = stub.style.order;
+                stub.replaceWith(node);
+                allQuestions[ordinal] = node;
+                applyProgressView(node);
+                if (typesetObserver) typesetObserver.observe(node);
+                if (imageObserver) imageObserver.observe(node);
+            }});
+            chunkState[k] = 'loaded';
+        }}
+        
+        // ========== 图片按需解码 ==========
+        
+        let imageTable = null;           // 图片的data URI
+        const imageURLs = new Map();     // 图片序号 -> {{ url, refs }}
+        const releasedImages = [];       // 已无引用的图片序号（最近释放的在后），超出上限时回收object URL
+        const IMAGE_URL_CACHE = 24;
+        let imageObserver = null;
+        
+        function initImages() {{
+            const table = document.getElementById('qbank-images');
+            if (!table) return;
+            imageTable = JSON.parse(table.textContent);
+            table.remove();
+            document.querySelectorAll('.header img[data-img]').forEach(acquireImage);
+            
+            if (!('IntersectionObserver' in window)) {{
+                document.querySelectorAll('img[data-img]').forEach(acquireImage);
+                return;
+            }}
+            // 题目进入视口附近时解码图片，离开（卡片模式下切走）时释放
+            imageObserver = new IntersectionObserver(entries => {{
+                entries.forEach(entry => {{
+                    entry.target.querySelectorAll('img[data-img]').forEach(entry.isIntersecting ? acquireImage : releaseImage);
+                }});
+            }}, {{ rootMargin: '600px 0px' }});
+            allQuestions.forEach(q => imageObserver.observe(q));
+        }}
+        
+        function createImageURL(i) {{
+            const uri = imageTable[i];
+            const comma = uri.indexOf(',');
+            const type = uri.slice(5, comma).split(';')[0];
+            const binary = atob(uri.slice(comma + 1));
+            const bytes = new Uint8Array(binary.length);
+            for (let k = 0; k < binary.length; k++) bytes[k] = binary.charCodeAt(k);
+            return URL.createObjectURL(new Blob([bytes], {{ type }}));
+        }}
+        
+        function acquireImage(img) {{
+            if (img.getAttribute('src')) return;
+            const i = Number(img.dataset.img);
+            let entry = imageURLs.get(i);
+            if (!entry) {{
+                entry = {{ url: createImageURL(i), refs: 0 }};
+                imageURLs.set(i, entry);
+            }} else if (entry.refs === 0) {{
+                releasedImages.splice(releasedImages.indexOf(i), 1);
+            }}
+            entry.refs++;
+            img.setAttribute('src', entry.url);
+        }}
+        
+        function releaseImage(img) {{
+            if (!img.getAttribute('src')) return;
+            img.removeAttribute('src');
+            const i = Number(img.dataset.img);
+            const entry = imageURLs.get(i);
+            if (--entry.refs > 0) return;
+            // 刚离开的图片先保留一段时间，来回翻题时不必重新解码
+            releasedImages.push(i);
+            if (releasedImages.length > IMAGE_URL_CACHE) {{
+                const old = releasedImages.shift();
+                URL.revokeObjectURL(imageURLs.get(old).url);
+                imageURLs.delete(old);
+            }}
+        }}
+        
+        // ========== 按需排版（公式和代码高亮） ==========
+        
+        const pendingTypeset = new Set();
+        const whenIdle = window.requestIdleCallback || function(cb) {{ return setTimeout(cb, 200); }};
+        
+        let typesetObserver = null;
+        
+        // 排版单道题：代码高亮 + MathJax公式，每题只做一次
+        function typesetQuestion(q) {{
+            // 分块输出的占位节点先展开所在的块
+            if (q && q.classList.contains('q-stub')) {{
+                if (!ensureChunk(Number(q.dataset.chunk))) return;
+                q = allQuestions[q.qbankOrdinal];
+            }}
+            if (!q || q.dataset.typeset === 'true') return;
+            
+            if (q.dataset.highlighted !== 'true') {{
+                if (window.hljs) {{
+                    q.querySelectorAll('pre code').forEach(el => hljs.highlightElement(el));
                 }}
+                q.dataset.highlighted = 'true';
+            }}
+            
+            if (!q.querySelector('.math-inline, .math-block')) {{
+                q.dataset.typeset = 'true';
+                return;
+            }}
+            
+            // MathJax尚未加载完成时先排队
+            if (!window.mathJaxReady) {{
+                pendingTypeset.add(q);
+                return;
+            }}
+            
+            q.dataset.typeset = 'true';
+            MathJax.typesetPromise([q]).catch(err => {{
+                q.dataset.typeset = 'false';
+                console.warn('公式排版失败', err);
             }});
         }}
         
+        // 空闲时预先排版当前题前后的题目
+        function typesetNeighboursWhenIdle(index) {{
+            whenIdle(function() {{
+                [index + 1, index - 1, index + 2].forEach(i => {{
+                    if (i >= 0 && i < visibleOrder.length) typesetQuestion(visibleQuestion(i));
+                }});
+            }});
+        }}
+        
+        // 列表/复习模式：只排版进入视口附近的题目
+        function initLazyTypeset() {{
+            window.onMathJaxReady = function() {{
+                const header = document.querySelector('.header');
+                if (header && header.querySelector('.math-inline, .math-block')) {{
+                    MathJax.typesetPromise([header]);
+                }}
+                const queued = Array.from(pendingTypeset);
+                pendingTypeset.clear();
+                queued.forEach(typesetQuestion);
+            }};
+            if (window.mathJaxReady) window.onMathJaxReady();
+            
+            if (!('IntersectionObserver' in window)) {{
+                document.querySelectorAll('.question').forEach(typesetQuestion);
+                return;
+            }}
+            const observer = typesetObserver = new IntersectionObserver(entries => {{
+                entries.forEach(entry => {{
+                    if (!entry.isIntersecting) return;
+                    typesetQuestion(entry.target);
+                    if (entry.target.dataset.typeset === 'true' || !entry.target.isConnected) {{
+                        observer.unobserve(entry.target);
+                    }}
+                }});
+            }}, {{ rootMargin: '300px 0px' }});
+            document.querySelectorAll('.question').forEach(q => observer.observe(q));
+        }}
+        
         // ========== 手机端专属功能 ==========
         
-        // 获取可见题目列表
-        function getVisibleQuestions() {{
-            return Array.from(document.querySelectorAll('.question:not(.hidden)'));
+        // 第index道可见题目（翻题时使用，不必生成整个列表）
+        function visibleQuestion(index) {{
+            return allQuestions[visibleOrder[index]];
         }}
         
-        // 显示指定题目（卡片模式）
+        // 显示指定题目（卡片模式）：只改动离开和进入的卡片，耗时与题库大小无关
         function showQuestion(index, direction = 'right') {{
-            const questions = getVisibleQuestions();
-            if (index < 0 || index >= questions.length) return;
+            if (index < 0 || index >= visibleOrder.length) return;
             
-            // 隐藏所有题目
-            questions.forEach(q => {{
-                q.classList.remove('active', 'slide-in-right', 'slide-in-left');
-            }});
+            // 隐藏上一张卡片（按序号取，分块展开后取到的是新节点）
+            if (activeOrdinal >= 0) {{
+                allQuestions[activeOrdinal].classList.remove('active', 'slide-in-right', 'slide-in-left');
+            }}
+            activeOrdinal = visibleOrder[index];
             
-            // 显示当前题目
-            const currentQ = questions[index];
+            // 显示当前题目（分块输出时先展开所在的块）
+            let currentQ = allQuestions[activeOrdinal];
+            if (currentQ.classList.contains('q-stub')) {{
+                const ready = ensureChunk(Number(currentQ.dataset.chunk), () => {{
+                    if (currentQuestionIndex === index) showQuestion(index, direction);
+                }});
+                if (ready) currentQ = allQuestions[currentQ.qbankOrdinal];
+            }}
             currentQ.classList.add('active');
+            typesetQuestion(currentQ);
+            typesetNeighboursWhenIdle(index);
             
             // 添加滑入动画
             if (direction === 'right') {{
@@ -1845,13 +4917,12 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         
         // 更新题目计数器
         function updateQuestionCounter() {{
-            const questions = getVisibleQuestions();
             const current = currentQuestionIndex + 1;
-            const total = questions.length;
+            const total = visibleOrder.length;
             document.getElementById('question-counter').textContent = `${{current}}/${{total}}`;
             
             // 更新底部标记按钮状态
-            const currentQ = questions[currentQuestionIndex];
+            const currentQ = visibleQuestion(currentQuestionIndex);
             const markBtn = document.getElementById('mobile-mark-btn');
             if (currentQ && markBtn) {{
                 if (currentQ.dataset.markImportant === 'true') {{
@@ -1864,7 +4935,6 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         
         // 上一题
         function prevQuestion() {{
-            const questions = getVisibleQuestions();
             if (currentQuestionIndex > 0) {{
                 showQuestion(currentQuestionIndex - 1, 'left');
             }}
@@ -1872,16 +4942,19 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         
         // 下一题
         function nextQuestion() {{
-            const questions = getVisibleQuestions();
-            if (currentQuestionIndex < questions.length - 1) {{
+            // 抽题模式：到达本轮末尾时抽取下一题
+            if (sessionMode && currentQuestionIndex >= visibleOrder.length - 1) {{
+                if (drawSessionQuestion()) showQuestion(visibleOrder.length - 1, 'right');
+                return;
+            }}
+            if (currentQuestionIndex < visibleOrder.length - 1) {{
                 showQuestion(currentQuestionIndex + 1, 'right');
             }}
         }}
         
         // 切换当前题目的重点标记
         function toggleCurrentMark() {{
-            const questions = getVisibleQuestions();
-            const currentQ = questions[currentQuestionIndex];
+            const currentQ = visibleQuestion(currentQuestionIndex);
             if (currentQ) {{
                 const markBtn = currentQ.querySelector('.mark-important');
                 if (markBtn) {{
@@ -1954,15 +5027,7 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         }}
         
         // 更新进度条
-        function updateProgressBar() {{
-            const questions = document.querySelectorAll('.question');
-            const total = questions.length;
-            let answered = 0;
-            
-            questions.forEach(q => {{
-                if (q.dataset.answered === 'true') answered++;
-            }});
-            
+        function updateProgressBar(answered, total) {{
             const progress = total > 0 ? (answered / total * 100) : 0;
             document.getElementById('progress-bar').style.width = progress + '%';
         }}
@@ -1992,6 +5057,328 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             }}
         }}
         
+        // ========== 记忆复习（SM-2间隔重复） ==========
+        
+        const DAY_MS = 24 * 60 * 60 * 1000;
+        
+        // 到期队列：按到期时间排列的二叉小顶堆，元素为 [到期时间, 题目序号]。
+        // 题目重新安排时直接压入新元素，旧元素出堆时与记录中的到期时间不符即丢弃（惰性删除）
+        let srsHeap = [];
+        
+        function heapLess(heap, a, b) {{
+            return heap[a][0] < heap[b][0];
+        }}
+        
+        function heapSiftDown(heap, i) {{
+            const n = heap.length;
+            while (true) {{
+                const left = 2 * i + 1;
+                const right = left + 1;
+                let smallest = i;
+                if (left < n && heapLess(heap, left, smallest)) smallest = left;
+                if (right < n && heapLess(heap, right, smallest)) smallest = right;
+                if (smallest === i) return;
+                [heap[i], heap[smallest]] = [heap[smallest], heap[i]];
+                i = smallest;
+            }}
+        }}
+        
+        function heapPush(heap, item) {{
+            heap.push(item);
+            let i = heap.length - 1;
+            while (i > 0) {{
+                const parent = (i - 1) >> 1;
+                if (!heapLess(heap, i, parent)) break;
+                [heap[i], heap[parent]] = [heap[parent], heap[i]];
+                i = parent;
+            }}
+        }}
+        
+        function heapPop(heap) {{
+            const top = heap[0];
+            const last = heap.pop();
+            if (heap.length > 0) {{
+                heap[0] = last;
+                heapSiftDown(heap, 0);
+            }}
+            return top;
+        }}
+        
+        // 自底向上建堆，O(n)
+        function heapify(heap) {{
+            for (let i = (heap.length >> 1) - 1; i >= 0; i--) heapSiftDown(heap, i);
+        }}
+        
+        function srsRecordOf(ordinal) {{
+            const record = progressStore[allQuestions[ordinal].dataset.qid];
+            return record && record.srs;
+        }}
+        
+        // 按SM-2更新题目的复习安排：答对质量记4，答错记1
+        function srsRecord(question, isCorrect) {{
+            const qid = question.dataset.qid;
+            const record = progressStore[qid] || (progressStore[qid] = {{}});
+            const srs = record.srs || {{ ease: 2.5, interval: 0, reps: 0, due: 0 }};
+            const quality = isCorrect ? 4 : 1;
+            
+            if (quality >= 3) {{
+                srs.interval = srs.reps === 0 ? 1 : srs.reps === 1 ? 6 : Math.round(srs.interval * srs.ease);
+                srs.reps++;
+            }} else {{
+                srs.reps = 0;
+                srs.interval = 1;
+            }}
+            srs.ease = Math.max(1.3, srs.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02));
+            srs.due = Date.now() + srs.interval * DAY_MS;
+            
+            record.srs = srs;
+            heapPush(srsHeap, [srs.due, question.qbankOrdinal]);
+        }}
+        
+        // 取出最早到期的题目序号，没有到期题目时返回-1（O(log n)，过期的堆元素顺便丢弃）
+        function srsNextDue(now) {{
+            while (srsHeap.length > 0) {{
+                const [due, ordinal] = srsHeap[0];
+                const srs = srsRecordOf(ordinal);
+                if (!srs || srs.due !== due) {{
+                    heapPop(srsHeap);
+                    continue;
+                }}
+                if (due > now) return -1;
+                heapPop(srsHeap);
+                return ordinal;
+            }}
+            return -1;
+        }}
+        
+        // 最早的到期时间（没有安排时为null）
+        function srsEarliestDue() {{
+            while (srsHeap.length > 0) {{
+                const [due, ordinal] = srsHeap[0];
+                const srs = srsRecordOf(ordinal);
+                if (srs && srs.due === due) return due;
+                heapPop(srsHeap);
+            }}
+            return null;
+        }}
+        
+        // 记忆复习抽题：取出到期题目，没有时提示下次到期时间
+        function srsDraw() {{
+            const ordinal = srsNextDue(Date.now());
+            if (ordinal < 0) {{
+                const due = srsEarliestDue();
+                alert(due === null ? '还没有复习安排，先去答题吧！'
+                                   : '暂无到期题目，下一题到期时间：' + new Date(due).toLocaleString());
+            }}
+            return ordinal;
+        }}
+        
+        // 结束复习：取出后没有作答的题目放回到期队列
+        function srsRequeue(ordinals) {{
+            ordinals.forEach(ordinal => {{
+                const srs = srsRecordOf(ordinal);
+                if (srs && srs.due <= Date.now()) heapPush(srsHeap, [srs.due, ordinal]);
+            }});
+        }}
+        
+        // ========== 加权练习 ==========
+        
+        // 默认权重：错题、重点（额外加权）、未做、已会，以及不重复窗口（最近抽过的题数）
+        const DEFAULT_PRACTICE_WEIGHTS = {{ wrong: 6, important: 3, unseen: 2, known: 1, window: 20 }};
+        
+        let practiceWeights = null;
+        let practiceTree = null;     // 树状数组，按序号累加每题的抽取权重
+        let practiceWeight = null;   // 每题当前的抽取权重
+        let practiceRecent = [];     // 窗口内最近抽过的题目序号，权重暂时为0
+        let practiceInWindow = null;
+        let practiceWindow = 0;
+        
+        // 树状数组（Fenwick树）：O(n)建树，单点修改和按前缀和查找都是O(log n)
+        function fenwickBuild(values) {{
+            const n = values.length;
+            const tree = new Float64Array(n + 1);
+            for (let i = 1; i <= n; i++) {{
+                tree[i] += values[i - 1];
+                const parent = i + (i & -i);
+                if (parent <= n) tree[parent] += tree[i];
+            }}
+            return tree;
+        }}
+        
+        function fenwickAdd(tree, i, delta) {{
+            for (i++; i < tree.length; i += i & -i) tree[i] += delta;
+        }}
+        
+        function fenwickPrefix(tree, count) {{
+            let sum = 0;
+            for (let i = count; i > 0; i -= i & -i) sum += tree[i];
+            return sum;
+        }}
+        
+        // 查找前缀和首次超过target的位置（从高位到低位逐位确定）
+        function fenwickFind(tree, target) {{
+            let pos = 0;
+            let step = 1;
+            while (step * 2 < tree.length) step *= 2;
+            for (; step > 0; step >>= 1) {{
+                const next = pos + step;
+                if (next < tree.length && tree[next] <= target) {{
+                    pos = next;
+                    target -= tree[next];
+                }}
+            }}
+            return pos;
+        }}
+        
+        function loadPracticeWeights() {{
+            const saved = localStorage.getItem('qbank_practice_weights');
+            return Object.assign({{}}, DEFAULT_PRACTICE_WEIGHTS, saved ? JSON.parse(saved) : {{}});
+        }}
+        
+        // 题目的抽取权重：错题、未做、已会三者取一，重点题另外加权；被筛选隐藏的题目不抽
+        function practiceWeightOf(ordinal) {{
+            if (hiddenFlags[ordinal]) return 0;
+            const q = allQuestions[ordinal];
+            const w = practiceWeights;
+            let weight = q.dataset.answered !== 'true' ? w.unseen : q.dataset.correct === 'true' ? w.known : w.wrong;
+            if (q.dataset.markImportant === 'true') weight += w.important;
+            return weight;
+        }}
+        
+        function practiceSet(ordinal, weight) {{
+            fenwickAdd(practiceTree, ordinal, weight - practiceWeight[ordinal]);
+            practiceWeight[ordinal] = weight;
+        }}
+        
+        function buildPractice() {{
+            practiceWeights = loadPracticeWeights();
+            practiceWeight = new Float64Array(allQuestions.length);
+            let candidates = 0;
+            allQuestions.forEach((q, i) => {{
+                practiceWeight[i] = practiceWeightOf(i);
+                if (practiceWeight[i] > 0) candidates++;
+            }});
+            practiceTree = fenwickBuild(practiceWeight);
+            practiceRecent = [];
+            practiceInWindow = new Uint8Array(allQuestions.length);
+            // 题目不多时缩小窗口，保证总有题可抽
+            practiceWindow = Math.max(0, Math.min(practiceWeights.window, candidates - 1));
+        }}
+        
+        // 按权重抽一题：窗口内不重复，抽中的题目权重置0，移出窗口时恢复
+        function practiceDraw() {{
+            if (!practiceTree) buildPractice();
+            const n = allQuestions.length;
+            const total = fenwickPrefix(practiceTree, n);
+            if (total <= 0) {{
+                alert('没有可抽取的题目，请调整筛选或权重');
+                return -1;
+            }}
+            let ordinal = Math.min(fenwickFind(practiceTree, Math.random() * total), n - 1);
+            
+            practiceSet(ordinal, 0);
+            practiceInWindow[ordinal] = 1;
+            practiceRecent.push(ordinal);
+            if (practiceRecent.length > practiceWindow) {{
+                const back = practiceRecent.shift();
+                practiceInWindow[back] = 0;
+                practiceSet(back, practiceWeightOf(back));
+            }}
+            return ordinal;
+        }}
+        
+        // 答题、重置或标记后更新权重（窗口内的题目移出窗口时再按最新状态恢复）
+        function practiceUpdate(questions) {{
+            questions.forEach(q => {{
+                const i = q.qbankOrdinal;
+                if (!practiceInWindow[i]) practiceSet(i, practiceWeightOf(i));
+            }});
+        }}
+        
+        function practiceStop() {{
+            practiceTree = null;
+            practiceRecent = [];
+        }}
+        
+        // 设置加权练习的权重
+        function configurePracticeWeights() {{
+            const w = loadPracticeWeights();
+            const input = prompt('加权练习权重：错题,重点(额外),未做,已会,不重复题数',
+                                 [w.wrong, w.important, w.unseen, w.known, w.window].join(','));
+            if (input === null) return;
+            const values = input.split(/[,，\s]+/).map(Number);
+            if (values.length !== 5 || values.some(v => !(v >= 0))) {{
+                alert('请输入5个非负数，用逗号分隔');
+                return;
+            }}
+            const [wrong, important, unseen, known, windowSize] = values;
+            localStorage.setItem('qbank_practice_weights',
+                JSON.stringify({{ wrong, important, unseen, known, window: Math.floor(windowSize) }}));
+            // 正在练习时按新权重重建
+            if (practiceTree) buildPractice();
+        }}
+        
+        // ========== 抽题模式（记忆复习、加权练习） ==========
+        
+        // 抽题模式下逐道抽取题目，上一题/下一题在本轮已抽出的题目中移动
+        const SESSION_MODES = {{
+            srs: {{ btn: 'srs-mode-btn', label: '🧠 记忆复习', activeLabel: '📝 退出复习', draw: srsDraw, stop: srsRequeue }},
+            practice: {{ btn: 'practice-mode-btn', label: '🎲 加权练习', activeLabel: '📝 退出练习', draw: practiceDraw, stop: practiceStop }},
+        }};
+        let sessionMode = null;
+        let sessionOrder = [];
+        
+        // 抽取下一题加入本轮；答过的题目先清空作答，重新作答
+        function drawSessionQuestion() {{
+            const ordinal = SESSION_MODES[sessionMode].draw();
+            if (ordinal < 0) return false;
+            
+            const prepare = () => {{
+                const q = allQuestions[ordinal];
+                const resetBtn = q.querySelector('.btn-reset');
+                if (q.dataset.answered === 'true' && resetBtn) resetQuestion(resetBtn);
+            }};
+            const q = allQuestions[ordinal];
+            if (!q.classList.contains('q-stub') || ensureChunk(Number(q.dataset.chunk), prepare)) prepare();
+            
+            sessionOrder.push(ordinal);
+            visibleOrder = sessionOrder;
+            return true;
+        }}
+        
+        function stopSession() {{
+            const mode = SESSION_MODES[sessionMode];
+            mode.stop(sessionOrder);
+            sessionOrder = [];
+            sessionMode = null;
+            const btn = document.getElementById(mode.btn);
+            btn.innerHTML = mode.label;
+            btn.style.background = '';
+        }}
+        
+        // 进入/退出抽题模式，答题结果直接更新复习安排或抽取权重
+        function toggleSessionMode(name) {{
+            if (sessionMode) {{
+                const active = sessionMode;
+                refreshVisibleOrder();
+                showQuestion(0, 'right');
+                if (active === name) return;
+            }}
+            
+            sessionMode = name;
+            sessionOrder = [];
+            if (!drawSessionQuestion()) {{
+                SESSION_MODES[name].stop([]);
+                sessionMode = null;
+                return;
+            }}
+            const btn = document.getElementById(SESSION_MODES[name].btn);
+            btn.innerHTML = SESSION_MODES[name].activeLabel;
+            btn.style.background = 'linear-gradient(135deg, #f093fb 0%, #f5576c 100%)';
+            if (document.body.classList.contains('review-mode')) toggleReviewMode();
+            showQuestion(0, 'right');
+        }}
+        
         // 切换复习模式
         function toggleReviewMode() {{
             const body = document.body;
@@ -2021,3 +5408,134 @@ HTML_TEMPLATE = """<!DOCTYPE html>
 </body>
 </html>
 """
+
+
+# 试卷打印模板（槽位：title/student/count/questions）
+EXAM_TEMPLATE = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <title>{title} - {student}</title>
+    <style>
+        body {{
+            font-family: 'Songti SC', 'SimSun', serif;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+            line-height: 1.6;
+        }}
+        h1 {{ text-align: center; font-size: 22px; }}
+        .paper-info {{ display: flex; justify-content: space-between; border-bottom: 1px solid #333; padding-bottom: 8px; }}
+        .q {{ margin: 16px 0; page-break-inside: avoid; }}
+        .q-type {{ color: #666; font-size: 14px; }}
+        .q-stem p, .q-options p {{ display: inline; margin: 0; }}
+        .q-options {{ list-style: none; padding-left: 2em; margin: 6px 0; }}
+        .opt-label {{ font-weight: bold; }}
+        img {{ max-width: 100%; }}
+        pre {{ background: #f5f5f5; padding: 8px; overflow-x: auto; }}
+        @media print {{ body {{ padding: 0; }} }}
+    </style>
+    <script>
+        window.MathJax = {{ tex: {{ inlineMath: [['$', '$']], displayMath: [['$$', '$$']] }} }};
+    </script>
+    <script src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js" async></script>
+</head>
+<body>
+    <h1>{title}</h1>
+    <div class="paper-info">
+        <span>考号：{student}</span>
+        <span>姓名：__________</span>
+        <span>共{count}题</span>
+    </div>
+    {questions}
+</body>
+</html>
+"""
+
+
+# PWA图标
+PWA_ICON = """<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100">
+<rect width="100" height="100" rx="20" fill="#667eea"/>
+<text x="50" y="68" font-size="56" text-anchor="middle">📚</text>
+</svg>
+"""
+
+
+# Service Worker（str.format模板，槽位为config）
+SERVICE_WORKER_TEMPLATE = """// 题库离线缓存（由 md_qbank_to_html 生成，请勿手动修改）
+const BANK = {config};
+
+// 每个题库一组缓存，名称带版本；CDN运行库所有题库共用一个缓存
+const CACHE_PREFIX = 'qbank-' + BANK.name + '-';
+const CACHE = CACHE_PREFIX + BANK.version;
+const RUNTIME_CACHE = 'qbank-runtime';
+
+// 安装新版本：地址（含内容哈希）相同的文件直接从旧版本缓存复制，只下载变化的文件
+self.addEventListener('install', event => {{
+    event.waitUntil((async () => {{
+        const cache = await caches.open(CACHE);
+        const oldNames = (await caches.keys()).filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE);
+        const oldCaches = await Promise.all(oldNames.map(name => caches.open(name)));
+        
+        for (const url of BANK.precache) {{
+            let response = null;
+            for (const old of oldCaches) {{
+                response = await old.match(url);
+                if (response) break;
+            }}
+            if (!response) {{
+                response = await fetch(url, {{ cache: 'no-cache' }});
+                if (!response.ok) throw new Error('下载失败：' + url + ' ' + response.status);
+            }}
+            await cache.put(url, response);
+        }}
+        
+        const runtime = await caches.open(RUNTIME_CACHE);
+        await Promise.all(BANK.runtime.map(async url => {{
+            if (await runtime.match(url)) return;
+            try {{
+                await runtime.put(url, await fetch(url, {{ mode: 'no-cors' }}));
+            }} catch (err) {{
+                // 离线安装时跳过，首次在线使用时再缓存
+            }}
+        }}));
+        await self.skipWaiting();
+    }})());
+}});
+
+// 启用新版本后删除本题库的旧版本缓存
+self.addEventListener('activate', event => {{
+    event.waitUntil((async () => {{
+        const names = await caches.keys();
+        await Promise.all(names.filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE)
+                               .map(name => caches.delete(name)));
+        await self.clients.claim();
+    }})());
+}});
+
+// 缓存优先：页面（不带版本参数访问）对应当前版本；CDN资源（如MathJax按需加载的组件）用到时存入共享缓存
+self.addEventListener('fetch', event => {{
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    event.respondWith((async () => {{
+        if (request.mode === 'navigate') {{
+            const page = await (await caches.open(CACHE)).match(BANK.page);
+            if (page) return page;
+        }}
+        const cached = await caches.match(request);
+        if (cached) return cached;
+        
+        const response = await fetch(request);
+        if (new URL(request.url).origin !== self.location.origin && (response.ok || response.type === 'opaque')) {{
+            const runtime = await caches.open(RUNTIME_CACHE);
+            await runtime.put(request, response.clone());
+        }}
+        return response;
+    }})());
+}});
+"""
+
+
+if __name__ == '__main__':
+    # 独立运行：python md_qbank_to_html.py <markdown文件> [输出html文件]
+    sys.exit(Plugin().execute_cli(sys.argv[1:]))